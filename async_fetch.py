@@ -0,0 +1,312 @@
+import asyncio
+import time
+from typing import Dict, Iterable, List, Optional, Tuple
+from body import Body
+from cache import Cache
+from disk_cache import DISK_CACHE
+from encoding_sniffer import charset_from_content_type
+from memory_cache import MEMORY_CACHE
+from request_header import RequestHeader
+from resource_timing import CACHE_HIT, CACHE_REVALIDATED, ResourceTiming, start_timing
+from response_stream import READ_SIZE, iter_gunzip
+from status import Status
+from tls_session import get_ssl_context
+from url import URL
+
+MAX_REDIRECTS = 5
+
+Origin = Tuple[str, str, int]
+
+class FetchResult:
+  def __init__(self, url: str, body: Optional[Body] = None,
+               error: Optional[BaseException] = None):
+    self.url = url
+    self.body = body
+    self.error = error
+
+  def __repr__(self) -> str:
+    if self.error is not None:
+      return f"FetchResult: {self.url} error={self.error!r}"
+    return f"FetchResult: {self.url}"
+
+class AsyncConnection:
+  def __init__(self, origin: Origin, reader: asyncio.StreamReader,
+               writer: asyncio.StreamWriter):
+    self.origin = origin
+    self.reader = reader
+    self.writer = writer
+    self.is_reused = False
+
+  def close(self):
+    self.writer.close()
+
+class Response:
+  def __init__(self, version: bytes, status: Status, headers: Dict[str, str], body: bytes):
+    self.version = version
+    self.status = status
+    self.headers = headers
+    self.body = body
+
+# Same semantics as `URL.request` (redirects, chunked, gzip, caching) on top
+# of asyncio streams, so many pages can be in flight on a single thread.
+class AsyncFetcher:
+  def __init__(self, per_host_concurrency: int = 6, timeout: float = 30.0):
+    self.per_host_concurrency = per_host_concurrency
+    self.timeout = timeout
+    self.host_limits: Dict[Origin, asyncio.Semaphore] = dict()
+    self.idle: Dict[Origin, List[AsyncConnection]] = dict()
+
+  def _host_limit(self, origin: Origin) -> asyncio.Semaphore:
+    if origin not in self.host_limits:
+      self.host_limits[origin] = asyncio.Semaphore(self.per_host_concurrency)
+    return self.host_limits[origin]
+
+  async def _connect(self, origin: Origin,
+                     timing: Optional[ResourceTiming]) -> AsyncConnection:
+    scheme, host, port = origin
+    context = get_ssl_context() if scheme == "https" else None
+    # DNS, TCP and TLS all happen inside `open_connection`, so they are
+    # reported as one connect phase.
+    if timing is not None:
+      timing.connect_start = time.perf_counter()
+    reader, writer = await asyncio.open_connection(
+      host, port, ssl=context, server_hostname=host if context else None)
+    if timing is not None:
+      timing.connect_end = time.perf_counter()
+    return AsyncConnection(origin=origin, reader=reader, writer=writer)
+
+  async def _acquire(self, origin: Origin,
+                     timing: Optional[ResourceTiming]) -> AsyncConnection:
+    connections = self.idle.get(origin)
+    while connections:
+      connection = connections.pop()
+      if connection.reader.at_eof() or connection.writer.is_closing():
+        connection.close()
+        continue
+      connection.is_reused = True
+      if timing is not None:
+        timing.connection_reused = True
+      return connection
+    return await self._connect(origin, timing)
+
+  def _release(self, connection: AsyncConnection):
+    connections = self.idle.setdefault(connection.origin, [])
+    if len(connections) < self.per_host_concurrency:
+      connections.append(connection)
+    else:
+      connection.close()
+
+  async def _read_chunked(self, reader: asyncio.StreamReader) -> bytes:
+    chunks = []
+    while True:
+      line = await reader.readline()
+      if not line:
+        raise RuntimeError("Unexpected EOF while reading chunk size")
+      line_str = line.strip().decode("utf8")
+      try:
+        chunk_size = int(line_str.split(";", 1)[0], 16)
+      except ValueError:
+        raise RuntimeError(f"Invalid chunk size line: {line_str!r}")
+      if chunk_size == 0:
+        while True:
+          trailer_line = await reader.readline()
+          if not trailer_line or trailer_line == b"\r\n":
+            return b"".join(chunks)
+      chunks.append(await reader.readexactly(chunk_size))
+      if await reader.readexactly(2) != b"\r\n":
+        raise RuntimeError("Missing CRLF after chunk data")
+
+  async def _read_until_eof(self, reader: asyncio.StreamReader) -> bytes:
+    chunks = []
+    while True:
+      data = await reader.read(READ_SIZE)
+      if not data:
+        return b"".join(chunks)
+      chunks.append(data)
+
+  async def _read_body(self, reader: asyncio.StreamReader, status: Status,
+                       headers: Dict[str, str]) -> bytes:
+    if not status.has_body():
+      return b""
+    content_length = headers.get("content-length")
+    transfer_encoding = headers.get("transfer-encoding")
+    if transfer_encoding and "chunked" in transfer_encoding.lower():
+      return await self._read_chunked(reader)
+    elif content_length:
+      return await reader.readexactly(int(content_length))
+    else:
+      return await self._read_until_eof(reader)
+
+  async def _send_request(self, url: URL, extra_headers: Optional[Dict[str, str]],
+                          timing: Optional[ResourceTiming]) -> Tuple[AsyncConnection, bytes]:
+    header = RequestHeader(path=url.path, host=url.host, extra_headers=extra_headers)
+    origin = (url.scheme, url.host, url.port)
+    while True:
+      connection = await self._acquire(origin, timing)
+      try:
+        if timing is not None:
+          timing.request_start = time.perf_counter()
+        connection.writer.write(header.encode())
+        await connection.writer.drain()
+        statusline = await connection.reader.readline()
+        if timing is not None:
+          timing.response_start = time.perf_counter()
+        if not statusline:
+          raise ConnectionError("Connection closed before status line")
+        return connection, statusline
+      except OSError:
+        connection.close()
+        if not connection.is_reused:
+          raise
+
+  async def _request(self, url: URL, extra_headers: Optional[Dict[str, str]],
+                     timing: Optional[ResourceTiming]) -> Response:
+    connection, statusline = await self._send_request(url, extra_headers, timing)
+    try:
+      reader = connection.reader
+      version, status_code, _ = statusline.split(b" ", 2)
+      status = Status(code=status_code)
+      headers = {}
+      header_size = len(statusline)
+      while True:
+        line = await reader.readline()
+        header_size += len(line)
+        if line in [b"\r\n", b""]:
+          break
+        key, value = line.split(b":", 1)
+        headers[key.decode("utf8").casefold()] = value.decode("utf8").strip()
+      body = await self._read_body(reader, status, headers)
+    except BaseException:
+      connection.close()
+      raise
+    if timing is not None:
+      timing.response_end = time.perf_counter()
+      timing.response_status = status.code
+      timing.encoded_body_size = len(body)
+      timing.transfer_size += header_size + len(body)
+    if url._is_reusable(version, status, headers):
+      self._release(connection)
+    else:
+      connection.close()
+    return Response(version=version, status=status, headers=headers, body=body)
+
+  def _decode(self, url: URL, response: Response,
+              timing: Optional[ResourceTiming]) -> Tuple[bytes, Body]:
+    raw_chunks: Iterable[bytes] = [response.body]
+    if response.headers.get("content-encoding") == "gzip":
+      raw_chunks = iter_gunzip(raw_chunks, timing)
+    raw_body = b"".join(raw_chunks)
+    if timing is not None:
+      timing.decoded_body_size = len(raw_body)
+    return raw_body, Body(
+      raw=raw_body,
+      charset=charset_from_content_type(response.headers.get("content-type")),
+      is_view_source=url.is_view_source,
+    )
+
+  def _follow(self, url: URL, location: str) -> URL:
+    # As `URL._follow`: a redirected view-source page is still shown as source.
+    target = URL(location)
+    target.is_view_source = url.is_view_source
+    return target
+
+  async def _fetch(self, url: URL, timing: Optional[ResourceTiming]) -> Body:
+    for redirect_count in range(MAX_REDIRECTS + 1):
+      if url.scheme in ["file", "data"]:
+        return await asyncio.to_thread(url.request)
+
+      key = url._get_url()
+      location = MEMORY_CACHE.get_redirect(key)
+      if location is not None and redirect_count < MAX_REDIRECTS:
+        url = self._follow(url, location)
+        if timing is not None:
+          timing.redirect_count += 1
+        continue
+
+      # The caches read, write and fsync files: that runs on worker threads,
+      # so it never stalls the other connections in flight.
+      cache = await asyncio.to_thread(url.lookup_cache, key)
+      if not cache is None and cache.is_fresh():
+        if timing is not None:
+          timing.cache_state = CACHE_HIT
+        return cache.body.with_view_source(url.is_view_source)
+
+      request_time = time.time()
+      try:
+        async with self._host_limit((url.scheme, url.host, url.port)):
+          response = await self._request(
+            url, cache.validators() if cache else None, timing)
+      except OSError:
+        if not cache is None and cache.can_serve_stale():
+          if timing is not None:
+            timing.cache_state = CACHE_HIT
+          return cache.body.with_view_source(url.is_view_source)
+        raise
+      response_time = time.time()
+
+      status = response.status
+      if status.is_not_modified() and not cache is None:
+        cache.refresh(response.headers, request_time, response_time)
+        await asyncio.to_thread(DISK_CACHE.update, key, cache.metadata())
+        if timing is not None:
+          timing.cache_state = CACHE_REVALIDATED
+        return cache.body.with_view_source(url.is_view_source)
+
+      if redirect_count < MAX_REDIRECTS and status.is_redirect():
+        location = response.headers.get("location")
+        if location is None:
+          raise RuntimeError("Redirect status, but no Location header")
+        location = url._resolve_location(location)
+        if status.is_permanent_redirect() and Cache.is_redirect_storable(response.headers):
+          MEMORY_CACHE.put_redirect(key, location)
+        url = self._follow(url, location)
+        if timing is not None:
+          timing.redirect_count += 1
+        continue
+
+      raw_body, body = self._decode(url, response, timing)
+      if Cache.is_storable(status.code, response.headers):
+        await asyncio.to_thread(
+          url.store_cache, key, raw_body, response.headers, request_time, response_time)
+      elif not cache is None:
+        await asyncio.to_thread(url.invalidate_cache, key)
+      return body
+
+  async def fetch(self, url: str) -> Body:
+    timing = start_timing(url)
+    body = await asyncio.wait_for(self._fetch(URL(url), timing), timeout=self.timeout)
+    if timing is not None:
+      timing.finish()
+    return body
+
+  def close(self):
+    for connections in self.idle.values():
+      for connection in connections:
+        connection.close()
+    self.idle.clear()
+
+async def fetch_many(urls: Iterable[str], concurrency: int = 10,
+                     per_host_concurrency: int = 6,
+                     timeout: float = 30.0) -> List[FetchResult]:
+  # Results come back in input order. A failing URL produces a result with
+  # `error` set instead of aborting the batch; cancelling `fetch_many`
+  # cancels every request still in flight.
+  fetcher = AsyncFetcher(per_host_concurrency=per_host_concurrency, timeout=timeout)
+  limit = asyncio.Semaphore(concurrency)
+
+  async def fetch_one(url: str) -> FetchResult:
+    async with limit:
+      try:
+        return FetchResult(url=url, body=await fetcher.fetch(url))
+      except asyncio.CancelledError:
+        raise
+      except Exception as e:
+        return FetchResult(url=url, error=e)
+
+  tasks = [asyncio.ensure_future(fetch_one(url)) for url in urls]
+  try:
+    return await asyncio.gather(*tasks)
+  finally:
+    for task in tasks:
+      task.cancel()
+    fetcher.close()
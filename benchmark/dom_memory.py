@@ -0,0 +1,60 @@
+import argparse
+import gc
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from body import Body
+from html_parser import Element, HTMLParser, Node
+from generators import sections as generate_document
+
+def count_nodes(root: Node) -> int:
+  count = 0
+  stack = [root]
+  while stack:
+    node = stack.pop()
+    count += 1
+    if isinstance(node, Element):
+      stack.extend(node.children)
+  return count
+
+def measure(sections: int, paragraph_words: int) -> dict:
+  # The source string exists before tracing starts, so `tree_bytes` is what
+  # the tree adds on top of one copy of the document.
+  content = generate_document(sections, paragraph_words)
+  gc.collect()
+  tracemalloc.start()
+  start = time.perf_counter()
+  root = HTMLParser(Body(content=content)).parse()
+  elapsed = time.perf_counter() - start
+  tree_bytes, peak_bytes = tracemalloc.get_traced_memory()
+  tracemalloc.stop()
+  nodes = count_nodes(root)
+  return {
+    "sections": sections,
+    "source_bytes": len(content),
+    "nodes": nodes,
+    "tree_bytes": tree_bytes,
+    "peak_bytes": peak_bytes,
+    "bytes_per_node": tree_bytes / nodes,
+    "parse_seconds": elapsed,
+  }
+
+def main():
+  parser = argparse.ArgumentParser(description="Measure DOM memory on synthetic documents.")
+  parser.add_argument("--sections", type=int, nargs="+", default=[1000, 10000, 50000])
+  parser.add_argument("--paragraph-words", type=int, default=12,
+                      help="words in the first run of each paragraph; raise it for text-heavy pages")
+  args = parser.parse_args()
+  print(f"{'nodes':>10} {'source':>12} {'tree':>12} {'peak':>12} {'B/node':>8} {'parse':>8}")
+  for sections in args.sections:
+    result = measure(sections, args.paragraph_words)
+    print(f"{result['nodes']:>10} {result['source_bytes']:>12} {result['tree_bytes']:>12} "
+          f"{result['peak_bytes']:>12} {result['bytes_per_node']:>8.1f} "
+          f"{result['parse_seconds']:>7.2f}s")
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,82 @@
+import random
+from typing import Callable, Dict, Tuple
+
+# Synthetic documents for the benchmarks. Every generator is deterministic
+# for a given size so runs can be compared against a saved baseline.
+
+WORDS = [
+  "lorem", "ipsum", "dolor", "sit", "amet", "consectetur", "adipiscing",
+  "elit", "sed", "do", "eiusmod", "tempor", "incididunt", "ut", "labore",
+]
+
+def _words(rng: random.Random, count: int) -> str:
+  return " ".join(rng.choice(WORDS) for _ in range(count))
+
+def sections(count: int, paragraph_words: int = 12, seed: int = 0) -> str:
+  # Roughly 20 nodes per section: nested blocks, lists, formatting and
+  # attributes, which is what real pages spend their nodes on.
+  rng = random.Random(seed)
+  parts = ["<html><head><title>benchmark</title></head><body>"]
+  for index in range(count):
+    parts.append(f"<div class=\"section\" id=\"s{index}\"><h2>{_words(rng, 3)}</h2>")
+    parts.append(f"<p>{_words(rng, paragraph_words)} <b>{_words(rng, 2)}</b> "
+                 f"{_words(rng, 8)} <i>{_words(rng, 2)}</i></p>")
+    parts.append("<ul>")
+    for _ in range(3):
+      parts.append(f"<li><a href=\"#s{index}\">{_words(rng, 4)}</a></li>")
+    parts.append("</ul></div>")
+  parts.append("</body></html>")
+  return "".join(parts)
+
+def deep_nesting(depth: int) -> str:
+  return "<html><body>" + "<div>" * depth + "deep" + "</div>" * depth + "</body></html>"
+
+def wide_siblings(count: int) -> str:
+  return "<html><body><div>" + "".join(
+    f"<span>item {index}</span>" for index in range(count)) + "</div></body></html>"
+
+def long_text(words: int, seed: int = 0) -> str:
+  rng = random.Random(seed)
+  return f"<html><body><p>{_words(rng, words)}</p></body></html>"
+
+def many_entities(count: int) -> str:
+  run = "a &amp; b &lt;c&gt; &#x2014; d&nbsp;e &copy; &#169; &notin; "
+  return "<html><body><p>" + run * count + "</p></body></html>"
+
+def large_pre(lines: int, seed: int = 0) -> str:
+  rng = random.Random(seed)
+  body = "\n".join(f"{index:6d}  {_words(rng, 8)}" for index in range(lines))
+  return f"<html><body><pre>{body}</pre></body></html>"
+
+def large_script(lines: int, seed: int = 0) -> str:
+  # Comparisons and markup in strings, as real scripts have, so the search
+  # for `</script>` keeps meeting `<`.
+  rng = random.Random(seed)
+  body = "\n".join(
+    f"if (i < {index}) html += \"<b>{_words(rng, 4)}</b>\";" for index in range(lines))
+  return f"<html><head><script>{body}</script></head><body><p>done</p></body></html>"
+
+def big_list(items: int, seed: int = 0) -> str:
+  rng = random.Random(seed)
+  parts = ["<html><body><ul>"]
+  for index in range(items):
+    parts.append(f"<li>{_words(rng, 5)}")
+    if index % 10 == 9:
+      parts.append("<ol><li>nested one<li>nested two</ol>")
+    parts.append("</li>")
+  parts.append("</ul></body></html>")
+  return "".join(parts)
+
+Generator = Callable[[int], str]
+
+# name -> (generator, default size)
+GENERATORS: Dict[str, Tuple[Generator, int]] = {
+  "sections": (sections, 2000),
+  "deep_nesting": (deep_nesting, 400),
+  "wide_siblings": (wide_siblings, 20000),
+  "long_text": (long_text, 100000),
+  "many_entities": (many_entities, 10000),
+  "large_pre": (large_pre, 20000),
+  "large_script": (large_script, 20000),
+  "big_list": (big_list, 10000),
+}
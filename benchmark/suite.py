@@ -0,0 +1,220 @@
+import argparse
+import gc
+import glob
+import json
+import os
+import platform
+import sys
+import time
+import tracemalloc
+from itertools import cycle
+from typing import Callable, Dict, List, Optional, Tuple
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ROOT)
+
+from body import Body
+from constant import WIDTH
+from font_cache import BACKENDS, TK_CALLS, set_backend
+from generators import GENERATORS
+from html_parser import HTMLParser, Node
+from html_tokenizer import Tokenizer
+from layout import DocumentLayout, paint_tree
+
+# Layout recurses once per nesting level.
+sys.setrecursionlimit(20000)
+
+Metrics = Dict[str, float]
+Results = Dict[str, Dict[str, Metrics]]
+
+# Viewport width change for the relayout phase.
+RESIZE_STEP = 40
+
+# Metrics compared against a baseline; a larger value is a regression.
+COMPARED_METRICS = ["seconds", "peak_bytes"]
+DEFAULT_THRESHOLD = 0.25
+# Timings below this are mostly noise and never count as a regression.
+MIN_COMPARED_SECONDS = 0.005
+
+def load_corpus() -> List[Tuple[str, str]]:
+  documents = []
+  for path in sorted(glob.glob(os.path.join(ROOT, "test", "*.html"))):
+    with open(path, encoding="utf8") as f:
+      documents.append((f"corpus/{os.path.basename(path)}", f.read()))
+  return documents
+
+def load_generated(scale: float) -> List[Tuple[str, str]]:
+  documents = []
+  for name, (generate, size) in GENERATORS.items():
+    documents.append((f"generated/{name}", generate(max(int(size * scale), 1))))
+  return documents
+
+def start_layout_backend(font_backend: str) -> Optional[str]:
+  # Tk fonts need a display (Xvfb will do); the glyph tables need nothing.
+  # Returns why layout cannot run, or None when it can.
+  set_backend(font_backend)
+  if font_backend != "tk":
+    return None
+  try:
+    import tkinter
+    window = tkinter.Tk()
+  except Exception as e:
+    return str(e)
+  window.withdraw()
+  return None
+
+def measure(run: Callable[[], object], repeat: int, source_bytes: int) -> Metrics:
+  # Timing takes the best of `repeat` runs. Memory comes from one extra run
+  # under tracemalloc, which would distort the timings.
+  best = None
+  for _ in range(repeat):
+    gc.collect()
+    start = time.perf_counter()
+    result = run()
+    elapsed = time.perf_counter() - start
+    del result
+    best = elapsed if best is None else min(best, elapsed)
+
+  gc.collect()
+  blocks = sys.getallocatedblocks()
+  tracemalloc.start()
+  result = run()
+  _, peak_bytes = tracemalloc.get_traced_memory()
+  tracemalloc.stop()
+  live_blocks = sys.getallocatedblocks() - blocks
+  del result
+
+  return {
+    "seconds": best,
+    "megabytes_per_second": source_bytes / best / 1e6 if best else 0.0,
+    "peak_bytes": peak_bytes,
+    "live_blocks": live_blocks,
+  }
+
+def tokenize(content: str) -> int:
+  tokenizer = Tokenizer()
+  count = sum(1 for _ in tokenizer.feed(content))
+  return count + sum(1 for _ in tokenizer.close())
+
+def parse(content: str) -> Node:
+  return HTMLParser(Body(content=content)).parse()
+
+# As a page comes off the network: the body is decoded and fed to the parser
+# one READ_SIZE window at a time, so a text run or raw text element spans
+# many feeds.
+def parse_streamed(encoded: bytes) -> Node:
+  return HTMLParser(Body(raw=encoded, charset="utf-8")).parse()
+
+def layout(root: Node):
+  document = DocumentLayout(viewport_width=WIDTH, node=root)
+  document.layout()
+  return document
+
+def paint(document) -> list:
+  commands = []
+  paint_tree(document, commands)
+  return commands
+
+def run_document(content: str, repeat: int, with_layout: bool) -> Dict[str, Metrics]:
+  encoded = content.encode("utf8")
+  source_bytes = len(encoded)
+  phases = {
+    "tokenize": measure(lambda: tokenize(content), repeat, source_bytes),
+    "parse": measure(lambda: parse(content), repeat, source_bytes),
+    "streamed": measure(lambda: parse_streamed(encoded), repeat, source_bytes),
+  }
+  if with_layout:
+    root = parse(content)
+    phases["layout"] = measure(lambda: layout(root), repeat, source_bytes)
+    # Tk round trips for one more layout, once fonts and widths are cached.
+    before = dict(TK_CALLS)
+    layout(root)
+    for call, count in TK_CALLS.items():
+      phases["layout"][f"tk_{call}_calls"] = count - before[call]
+    document = layout(root)
+    phases["paint"] = measure(lambda: paint(document), repeat, source_bytes)
+    # Live resizing: each run lays the same tree out at the other width.
+    widths = cycle([WIDTH - RESIZE_STEP, WIDTH])
+    phases["relayout"] = measure(lambda: document.layout(next(widths)), repeat, source_bytes)
+  return phases
+
+def compare(results: Results, baseline: Results, threshold: float) -> List[str]:
+  regressions = []
+  for document, phases in results.items():
+    for phase, metrics in phases.items():
+      previous = baseline.get(document, {}).get(phase)
+      if previous is None:
+        continue
+      for metric in COMPARED_METRICS:
+        before, after = previous.get(metric), metrics.get(metric)
+        if not before or after is None:
+          continue
+        if metric == "seconds" and max(before, after) < MIN_COMPARED_SECONDS:
+          continue
+        change = (after - before) / before
+        if change > threshold:
+          regressions.append(
+            f"{document} {phase} {metric}: {before:.6g} -> {after:.6g} (+{change:.0%})")
+  return regressions
+
+def print_results(results: Results):
+  print(f"{'document':<44} {'phase':<9} {'seconds':>9} {'MB/s':>8} {'peak':>12} {'blocks':>9}")
+  for document, phases in results.items():
+    for phase, metrics in phases.items():
+      print(f"{document:<44} {phase:<9} {metrics['seconds']:>9.4f} "
+            f"{metrics['megabytes_per_second']:>8.2f} {metrics['peak_bytes']:>12} "
+            f"{metrics['live_blocks']:>9}")
+
+def main() -> int:
+  parser = argparse.ArgumentParser(description="Headless parser and layout benchmarks.")
+  parser.add_argument("--repeat", type=int, default=3)
+  parser.add_argument("--scale", type=float, default=1.0,
+                      help="multiplies the size of every generated document")
+  parser.add_argument("--only", help="run documents whose name contains this string")
+  parser.add_argument("--no-layout", action="store_true")
+  parser.add_argument("--font-backend", choices=sorted(BACKENDS), default="glyph",
+                      help="text metrics used by layout (default glyph, which runs headless)")
+  parser.add_argument("--save", metavar="PATH", help="write the results as a JSON baseline")
+  parser.add_argument("--baseline", metavar="PATH", help="compare against a saved baseline")
+  parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD,
+                      help="allowed relative slowdown or memory growth (default 0.25)")
+  args = parser.parse_args()
+
+  with_layout = not args.no_layout
+  if with_layout:
+    reason = start_layout_backend(args.font_backend)
+    if reason is not None:
+      print(f"Skipping layout and paint: {reason}", file=sys.stderr)
+      with_layout = False
+
+  results: Results = {}
+  for name, content in load_corpus() + load_generated(args.scale):
+    if args.only and args.only not in name:
+      continue
+    results[name] = run_document(content, args.repeat, with_layout)
+  print_results(results)
+
+  if args.save:
+    with open(args.save, "w") as f:
+      json.dump({
+        "python": platform.python_version(),
+        "scale": args.scale,
+        "font_backend": args.font_backend,
+        "results": results,
+      }, f, indent=2)
+
+  if args.baseline:
+    with open(args.baseline) as f:
+      baseline = json.load(f)
+    if baseline.get("scale") != args.scale:
+      print(f"Baseline was recorded at scale {baseline.get('scale')}", file=sys.stderr)
+      return 2
+    regressions = compare(results, baseline["results"], args.threshold)
+    for regression in regressions:
+      print(f"REGRESSION {regression}", file=sys.stderr)
+    if regressions:
+      return 1
+  return 0
+
+if __name__ == "__main__":
+  sys.exit(main())
@@ -1,4 +1,122 @@
+import codecs
+import itertools
+import time
+from typing import Iterator, List, Optional
+from encoding_sniffer import PRESCAN_SIZE, sniff_encoding
+from resource_timing import ResourceTiming
+from response_stream import READ_SIZE, iter_decode
+
+RawContent = bytes | bytearray | memoryview
+
+# Undecodable bytes become U+FFFD instead of failing the whole page.
+DECODE_ERRORS = "replace"
+
 class Body:
-  def __init__(self, content: str, is_view_source: bool=False):
-    self.content = content
+  def __init__(self, content: Optional[str] = None, is_view_source: bool=False,
+               raw: Optional[RawContent] = None,
+               raw_chunks: Optional[Iterator[bytes]] = None,
+               charset: Optional[str] = None,
+               timing: Optional[ResourceTiming] = None):
+    assert(content is not None or raw is not None or raw_chunks is not None)
+    self._content = content
+    # Raw bytes are kept as given (a memoryview is not copied) and only
+    # decoded when text is actually asked for.
+    self._raw = raw
+    # A streamed body can be iterated once. Joining it into `raw` or
+    # `content` keeps the whole document in memory, so streaming consumers
+    # should prefer `iter_content`.
+    self.raw_chunks = raw_chunks
+    self.charset = charset
     self.is_view_source = is_view_source
+    self._encoding: Optional[str] = None
+    # Reported once the body has been read to the end (and decoded, if text
+    # was asked for).
+    self.timing = timing
+
+  def _take_raw_chunks(self) -> Iterator[bytes]:
+    if self.raw_chunks is None:
+      raise RuntimeError("Streamed body was already consumed")
+    chunks, self.raw_chunks = self.raw_chunks, None
+    return chunks
+
+  def _finish_timing(self):
+    if self.timing is not None:
+      self.timing.finish()
+      self.timing = None
+
+  def _join_raw(self) -> RawContent:
+    if self._raw is None:
+      if self._content is not None:
+        self._raw = self._content.encode("utf8")
+      else:
+        self._raw = b"".join(self._take_raw_chunks())
+    return self._raw
+
+  @property
+  def raw(self) -> RawContent:
+    raw = self._join_raw()
+    self._finish_timing()
+    return raw
+
+  @property
+  def encoding(self) -> str:
+    if self._encoding is None:
+      if self._content is not None and self._raw is None:
+        self._encoding = "utf-8"
+      else:
+        self._encoding = sniff_encoding(bytes(self._join_raw()[:PRESCAN_SIZE]), self.charset)
+    return self._encoding
+
+  @property
+  def content(self) -> str:
+    if self._content is None:
+      raw = self._join_raw()
+      timing = self.timing
+      if timing is not None:
+        start = time.perf_counter()
+        self._content = codecs.decode(raw, self.encoding, DECODE_ERRORS)
+        timing.decode_duration += time.perf_counter() - start
+      else:
+        self._content = codecs.decode(raw, self.encoding, DECODE_ERRORS)
+    self._finish_timing()
+    return self._content
+
+  def iter_content(self) -> Iterator[str]:
+    if self._content is not None:
+      self._finish_timing()
+      if self._content:
+        yield self._content
+      return
+    if self._raw is not None:
+      # Decode window by window; the full text is never held at once.
+      raw = memoryview(self._raw)
+      windows = (raw[start:start + READ_SIZE] for start in range(0, len(raw), READ_SIZE))
+      yield from iter_decode(windows, self.encoding, DECODE_ERRORS, self.timing)
+      self._finish_timing()
+      return
+    chunks = self._take_raw_chunks()
+    head: List[bytes] = []
+    head_size = 0
+    for chunk in chunks:
+      head.append(chunk)
+      head_size += len(chunk)
+      if head_size >= PRESCAN_SIZE:
+        break
+    self._encoding = sniff_encoding(b"".join(head)[:PRESCAN_SIZE], self.charset)
+    yield from iter_decode(
+      itertools.chain(head, chunks), self._encoding, DECODE_ERRORS, self.timing)
+    self._finish_timing()
+
+  def with_view_source(self, is_view_source: bool):
+    # Cached bodies are shared by every URL; hand out a view that shares the
+    # bytes (and decoded text, if any) but carries the caller's flag.
+    if is_view_source == self.is_view_source:
+      return self
+    body = Body(
+      content=self._content,
+      raw=self.raw,
+      charset=self.charset,
+      is_view_source=is_view_source,
+    )
+    body._encoding = self._encoding
+    return body
@@ -2,8 +2,10 @@ import tkinter
 from constant import HEIGHT, SCROLL_STEP, SCROLLBAR_PADDING, SCROLLBAR_WIDTH, WIDTH
 from layout import VSTEP, Commands, DocumentLayout, paint_tree
 from logger import print_tree
-from html_parser import Element, create_html_parser
+from dom_snapshot import parse_document
+from html_parser import Element
 from url import URL
+from view_source import ViewSource
 
 SCROLLBAR_BOX_WIDHT = SCROLLBAR_WIDTH + 2 * SCROLLBAR_PADDING
 
@@ -22,10 +24,13 @@ class Browser:
     self.window.bind("<MouseWheel>", self.on_mouse_wheel)
     self.window.bind("<Configure>", self.on_configure)
     self.root: Element = None
+    self.view_source: ViewSource = None
+    self.document: DocumentLayout | ViewSource | None = None
     self.commands: Commands = []
+    self.layout_pending = False
 
   def _content_max_y(self):
-    if not hasattr(self, "document") or self.document.height is None:
+    if self.document is None or self.document.height is None:
       return 0
     return max(self.document.height + 2 * VSTEP, 0)
 
@@ -71,6 +76,13 @@ class Browser:
       self._scroll_internal(e.delta)
 
   def on_configure(self, _):
+    # Live resizing sends bursts of events; lay out once the burst is over.
+    if not self.layout_pending:
+      self.layout_pending = True
+      self.window.after_idle(self._layout_after_configure)
+
+  def _layout_after_configure(self):
+    self.layout_pending = False
     self.layout_and_draw()
 
   def draw_scrollbar(self):
@@ -89,6 +101,9 @@ class Browser:
   def draw_content(self):
     self.canvas.delete("all")
     height = self._window_height()
+    if self.view_source is not None:
+      # Only the lines around the viewport are turned into commands.
+      self.commands = self.view_source.paint(self.scroll, height)
     for command in self.commands:
       if command.top > self.scroll + height:
         continue
@@ -100,15 +115,31 @@ class Browser:
     viewport_width = self._viewport_width()
     if viewport_width < 0:
       return
-    self.commands = []
-    self.document = DocumentLayout(
-      viewport_width=viewport_width,
-      node=self.root,
-    )
-    self.document.layout()
-
-    print_tree(self.document)
+    if self.view_source is not None:
+      self.commands = []
+      self.document = self.view_source
+      self.document.layout(viewport_width)
+      self.draw_content()
+      self.draw_scrollbar()
+      return
+    if self.document is None:
+      self.document = DocumentLayout(
+        viewport_width=viewport_width,
+        node=self.root,
+      )
+      self.document.layout()
+      print_tree(self.document)
+    elif viewport_width != self.document.viewport_width:
+      # The layout tree survives resizes; only blocks whose lines break
+      # differently at the new width are laid out again.
+      self.document.layout(viewport_width)
+    else:
+      # Moves and height-only resizes change no positions.
+      self.draw_content()
+      self.draw_scrollbar()
+      return
 
+    self.commands = []
     paint_tree(self.document, self.commands)
     self.draw_content()
     self.draw_scrollbar()
@@ -116,7 +147,13 @@ class Browser:
   def load(self, url: URL):
     try:
       body = url.request()
-      self.root = create_html_parser(body=body).parse()
+      self.document = None
+      if body.is_view_source:
+        self.view_source = ViewSource(body)
+        self.root = None
+      else:
+        self.view_source = None
+        self.root = parse_document(body)
       self.layout_and_draw()
     except Exception as e:
       print(f"Error: {e}")
@@ -1,7 +1,126 @@
 import time
+from email.utils import parsedate_to_datetime
+from typing import Dict, Optional
 from body import Body
+from cache_control import CacheControl
+
+# Response headers a cache entry needs to compute freshness and revalidate.
+STORED_HEADERS = [
+  "cache-control", "date", "expires", "age", "etag", "last-modified", "content-type", "vary",
+]
+HEURISTIC_FRACTION = 0.1
+HEURISTIC_MAX_LIFETIME = 24 * 60 * 60
+
+def parse_http_date(value: Optional[str]) -> Optional[float]:
+  if value is None:
+    return None
+  try:
+    return parsedate_to_datetime(value).timestamp()
+  except (TypeError, ValueError, IndexError):
+    return None
+
+def parse_cache_control(headers: Dict[str, str]) -> Optional[CacheControl]:
+  raw = headers.get("cache-control")
+  if not raw:
+    return None
+  return CacheControl(raw=raw)
 
 class Cache:
-  def __init__(self, body: Body, max_age: int):
+  def __init__(self, body: Body, headers: Dict[str, str],
+               request_time: float, response_time: float):
     self.body = body
-    self.expired_at = time.time() + max_age
+    self.headers: Dict[str, str] = dict()
+    self._update(headers, request_time, response_time)
+
+  @staticmethod
+  def is_storable(status_code: int, headers: Dict[str, str]) -> bool:
+    if status_code != 200:
+      return False
+    cache_control = parse_cache_control(headers)
+    if cache_control is not None and cache_control.no_store:
+      return False
+    if headers.get("vary", "").strip() == "*":
+      return False
+    # Anything with explicit freshness or a validator is worth keeping:
+    # even a stale entry saves the body transfer on a 304.
+    return cache_control is not None or any(
+      key in headers for key in ["expires", "etag", "last-modified"])
+
+  @staticmethod
+  def is_redirect_storable(headers: Dict[str, str]) -> bool:
+    cache_control = parse_cache_control(headers)
+    return cache_control is None or \
+        not (cache_control.no_store or cache_control.no_cache)
+
+  def _update(self, headers: Dict[str, str], request_time: float, response_time: float):
+    for key in STORED_HEADERS:
+      if key in headers:
+        self.headers[key] = headers[key]
+    self.request_time = request_time
+    self.response_time = response_time
+    self.cache_control = parse_cache_control(self.headers)
+    self.freshness_lifetime = self._freshness_lifetime()
+    self.corrected_initial_age = self._corrected_initial_age()
+
+  def _freshness_lifetime(self) -> float:
+    cache_control = self.cache_control
+    if cache_control is not None and cache_control.max_age is not None:
+      return cache_control.max_age
+    # `s-maxage` only applies to shared caches; a browser cache is private.
+    date = parse_http_date(self.headers.get("date")) or self.response_time
+    if "expires" in self.headers:
+      expires = parse_http_date(self.headers["expires"])
+      if expires is None:
+        return 0
+      return max(expires - date, 0)
+    last_modified = parse_http_date(self.headers.get("last-modified"))
+    if last_modified is not None:
+      return min(max(date - last_modified, 0) * HEURISTIC_FRACTION,
+                 HEURISTIC_MAX_LIFETIME)
+    return 0
+
+  def _corrected_initial_age(self) -> float:
+    date = parse_http_date(self.headers.get("date"))
+    apparent_age = max(self.response_time - date, 0) if date is not None else 0
+    try:
+      age_value = max(int(self.headers.get("age", "0")), 0)
+    except ValueError:
+      age_value = 0
+    response_delay = self.response_time - self.request_time
+    return max(apparent_age, age_value + response_delay)
+
+  def current_age(self, now: Optional[float] = None) -> float:
+    now = time.time() if now is None else now
+    return self.corrected_initial_age + (now - self.response_time)
+
+  def is_fresh(self, now: Optional[float] = None) -> bool:
+    if self.cache_control is not None and self.cache_control.no_cache:
+      return False
+    return self.freshness_lifetime > self.current_age(now)
+
+  def can_serve_stale(self) -> bool:
+    cache_control = self.cache_control
+    return cache_control is None or \
+        not (cache_control.no_cache or cache_control.must_revalidate)
+
+  def has_validators(self) -> bool:
+    return "etag" in self.headers or "last-modified" in self.headers
+
+  def validators(self) -> Dict[str, str]:
+    validators = {}
+    if "etag" in self.headers:
+      validators["If-None-Match"] = self.headers["etag"]
+    if "last-modified" in self.headers:
+      validators["If-Modified-Since"] = self.headers["last-modified"]
+    return validators
+
+  def refresh(self, headers: Dict[str, str], request_time: float, response_time: float):
+    # A 304 carries updated metadata for the stored body (RFC 9111 4.3.4).
+    self._update(headers, request_time, response_time)
+
+  def metadata(self) -> dict:
+    return {
+      "headers": self.headers,
+      "request_time": self.request_time,
+      "response_time": self.response_time,
+    }
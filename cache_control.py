@@ -1,14 +1,39 @@
+from typing import Optional
+
 class CacheControl:
   def __init__(self, raw: str):
     assert(raw.__len__() > 0)
     directives = raw.split(",")
     self.no_store = False
-    self.max_age = 0
+    self.no_cache = False
+    self.must_revalidate = False
+    self.max_age: Optional[int] = None
+    self.s_maxage: Optional[int] = None
     for directive in directives:
+      directive = directive.strip().casefold()
       if "=" in directive:
-        key, value = directive.split("=")
+        key, value = directive.split("=", 1)
+        key = key.strip()
+        value = value.strip().strip("\"")
         if key == "max-age":
-          self.max_age = int(value)
+          self.max_age = self._parse_seconds(value)
+        elif key == "s-maxage":
+          self.s_maxage = self._parse_seconds(value)
+        elif key == "no-cache":
+          # `no-cache="field"` only restricts the listed fields; we do not
+          # store per-field state, so treat it like a bare `no-cache`.
+          self.no_cache = True
       else:
         if directive == "no-store":
           self.no_store = True
+        elif directive == "no-cache":
+          self.no_cache = True
+        elif directive in ["must-revalidate", "proxy-revalidate"]:
+          self.must_revalidate = True
+
+  def _parse_seconds(self, value: str) -> int:
+    try:
+      return max(int(value), 0)
+    except ValueError:
+      # An invalid delta-seconds makes the response stale (RFC 9111 4.2.1).
+      return 0
@@ -0,0 +1,68 @@
+import re
+from html.entities import html5
+
+# One pass over the text: every `&` that starts a decimal, hex or named
+# character reference is matched and replaced by `_replace`.
+CHARACTER_REFERENCE = re.compile(
+  r"&(?:#([0-9]+);?|#[xX]([0-9a-fA-F]+);?|([A-Za-z][A-Za-z0-9]*)(;?))")
+REPLACEMENT_CHARACTER = "\uFFFD"
+MAX_CODE_POINT = 0x10FFFF
+# Names that are recognised without a trailing `;` (`&amp`, `&copy`, ...).
+LEGACY_NAMES = frozenset(name for name in html5 if not name.endswith(";"))
+LEGACY_NAME_MAX_LENGTH = max(len(name) for name in LEGACY_NAMES)
+
+def _numeric(code_point: int) -> str:
+  if code_point == 0 or code_point > MAX_CODE_POINT or 0xD800 <= code_point <= 0xDFFF:
+    return REPLACEMENT_CHARACTER
+  if 0x80 <= code_point <= 0x9F:
+    # C1 controls are read as windows-1252, as the spec requires.
+    try:
+      return bytes([code_point]).decode("cp1252")
+    except UnicodeDecodeError:
+      return chr(code_point)
+  return chr(code_point)
+
+def _replace(match: re.Match, is_attribute: bool) -> str:
+  decimal, hexadecimal, name, semicolon = match.groups()
+  # Past leading zeros, longer digit strings are out of range anyway.
+  if decimal is not None:
+    decimal = decimal.lstrip("0") or "0"
+    return _numeric(int(decimal)) if len(decimal) <= 8 else REPLACEMENT_CHARACTER
+  if hexadecimal is not None:
+    hexadecimal = hexadecimal.lstrip("0") or "0"
+    return _numeric(int(hexadecimal, 16)) if len(hexadecimal) <= 6 else REPLACEMENT_CHARACTER
+  if semicolon:
+    character = html5.get(name + ";")
+    if character is not None:
+      return character
+  # Without `;`, only the legacy names count, matched as the longest prefix
+  # (`&notit;` is `¬it;`).
+  for length in range(min(len(name), LEGACY_NAME_MAX_LENGTH), 1, -1):
+    prefix = name[:length]
+    if prefix not in LEGACY_NAMES:
+      continue
+    rest = name[length:] + semicolon
+    if is_attribute:
+      # `href="?a=1&copy=2"` keeps its `&copy`: in attribute values a
+      # legacy reference followed by `=` or an alphanumeric is literal.
+      following = rest[:1] or match.string[match.end():match.end() + 1]
+      if following == "=" or following.isalnum():
+        return match.group()
+    return html5[prefix] + rest
+  return match.group()
+
+def _replace_text(match: re.Match) -> str:
+  return _replace(match, is_attribute=False)
+
+def _replace_attribute(match: re.Match) -> str:
+  return _replace(match, is_attribute=True)
+
+def decode_text(text: str) -> str:
+  if "&" not in text:
+    return text
+  return CHARACTER_REFERENCE.sub(_replace_text, text)
+
+def decode_attribute(value: str) -> str:
+  if "&" not in value:
+    return value
+  return CHARACTER_REFERENCE.sub(_replace_attribute, value)
@@ -0,0 +1,130 @@
+import select
+import socket
+import ssl
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+from dns_cache import DNS_CACHE
+from resource_timing import ResourceTiming
+from tls_session import TLS_SESSIONS
+
+Origin = Tuple[str, str, int]
+
+class Connection:
+  def __init__(self, origin: Origin, sock: socket.socket):
+    self.origin = origin
+    self.socket = sock
+    # Keep one buffered reader per socket. A fresh `makefile` per request
+    # could drop bytes that the previous reader already buffered.
+    self.response = sock.makefile("rb")
+    self.idle_since = time.monotonic()
+    self.is_reused = False
+
+  def send(self, data: bytes):
+    self.socket.sendall(data)
+
+  def is_stale(self) -> bool:
+    # An idle keep-alive socket must not be readable. If it is, the peer
+    # either closed it (EOF) or sent something we never asked for.
+    if isinstance(self.socket, ssl.SSLSocket) and self.socket.pending():
+      return True
+    try:
+      readable, _, _ = select.select([self.socket], [], [], 0)
+    except (OSError, ValueError):
+      return True
+    return bool(readable)
+
+  def close(self):
+    try:
+      self.response.close()
+      self.socket.close()
+    except OSError:
+      pass
+
+class ConnectionPool:
+  def __init__(self, max_idle_per_origin: int = 6, idle_timeout: float = 60.0):
+    self.max_idle_per_origin = max_idle_per_origin
+    self.idle_timeout = idle_timeout
+    self.idle: Dict[Origin, List[Connection]] = dict()
+    self.lock = threading.Lock()
+
+  def _connect(self, origin: Origin, timing: Optional[ResourceTiming]) -> Connection:
+    scheme, host, port = origin
+    sock = None
+    error: Optional[OSError] = None
+    if timing is not None:
+      timing.domain_lookup_start = time.perf_counter()
+    addresses = DNS_CACHE.resolve(host, port)
+    if timing is not None:
+      timing.domain_lookup_end = timing.connect_start = time.perf_counter()
+    for family, socket_type, proto, _, address in addresses:
+      sock = socket.socket(family=family, type=socket_type, proto=proto)
+      try:
+        sock.connect(address)
+        break
+      except OSError as e:
+        sock.close()
+        sock = None
+        error = e
+    if sock is None:
+      # Cached addresses may have gone stale; resolve again next time.
+      DNS_CACHE.forget(host, port)
+      raise error or OSError(f"No address for {host}:{port}")
+    if scheme == "https":
+      if timing is not None:
+        timing.secure_connection_start = time.perf_counter()
+      try:
+        sock = TLS_SESSIONS.wrap(sock, host, port)
+      except BaseException:
+        # A failed handshake or certificate check must not leak the socket.
+        sock.close()
+        raise
+    if timing is not None:
+      timing.connect_end = time.perf_counter()
+    return Connection(origin=origin, sock=sock)
+
+  def acquire(self, scheme: str, host: str, port: int,
+              timing: Optional[ResourceTiming] = None) -> Connection:
+    origin = (scheme, host, port)
+    now = time.monotonic()
+    while True:
+      with self.lock:
+        connections = self.idle.get(origin)
+        connection = connections.pop() if connections else None
+      if connection is None:
+        return self._connect(origin, timing)
+      if now - connection.idle_since > self.idle_timeout or connection.is_stale():
+        connection.close()
+        continue
+      connection.is_reused = True
+      if timing is not None:
+        timing.connection_reused = True
+      return connection
+
+  def release(self, connection: Connection):
+    connection.idle_since = time.monotonic()
+    self._remember_session(connection)
+    with self.lock:
+      connections = self.idle.setdefault(connection.origin, [])
+      if len(connections) < self.max_idle_per_origin:
+        connections.append(connection)
+        return
+    connection.close()
+
+  def discard(self, connection: Connection):
+    self._remember_session(connection)
+    connection.close()
+
+  def _remember_session(self, connection: Connection):
+    if isinstance(connection.socket, ssl.SSLSocket):
+      _, host, port = connection.origin
+      TLS_SESSIONS.remember(connection.socket, host, port)
+
+  def clear(self):
+    with self.lock:
+      connections = [c for idle in self.idle.values() for c in idle]
+      self.idle.clear()
+    for connection in connections:
+      connection.close()
+
+POOL = ConnectionPool()
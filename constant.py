@@ -1,4 +1,12 @@
+import os
+
 WIDTH, HEIGHT = 800, 600
 SCROLL_STEP = 100
 SCROLLBAR_WIDTH = 10
-SCROLLBAR_PADDING = 4
\ No newline at end of file
+SCROLLBAR_PADDING = 4
+
+CACHE_DIRECTORY = os.environ.get(
+  "BROWSER_CACHE_DIR",
+  os.path.join(os.path.expanduser("~"), ".cache", "minseong-browser"),
+)
+CACHE_MAX_BYTES = 64 * 1024 * 1024
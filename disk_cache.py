@@ -0,0 +1,460 @@
+import atexit
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional, Tuple
+from constant import CACHE_DIRECTORY, CACHE_MAX_BYTES
+
+try:
+  import fcntl
+except ImportError:
+  fcntl = None
+
+INDEX_FILE = "index.json"
+JOURNAL_FILE = "journal.jsonl"
+LOCK_FILE = "lock"
+BLOB_DIRECTORY = "blobs"
+# Bodies being streamed into the cache.
+TEMP_DIRECTORY = "tmp"
+# Temporary files not written to for this long were left behind by a crash.
+TEMP_MAX_AGE = 60 * 60
+# The journal is folded into the index once it holds this many records and
+# at least as many as the index has entries, so rewriting the index costs
+# O(1) per write on average.
+COMPACT_RECORDS = 1000
+
+Record = list
+
+class DiskCacheEntry:
+  def __init__(self, blob: str, size: int, metadata: dict, last_used: float):
+    self.blob = blob
+    self.size = size
+    self.metadata = metadata
+    self.last_used = last_used
+
+  def to_json(self) -> dict:
+    return {
+      "blob": self.blob,
+      "size": self.size,
+      "metadata": self.metadata,
+      "last_used": self.last_used,
+    }
+
+  @staticmethod
+  def from_json(raw: dict):
+    return DiskCacheEntry(
+      blob=raw["blob"],
+      size=raw["size"],
+      metadata=raw["metadata"],
+      last_used=raw["last_used"],
+    )
+
+# Writes a streamed body to a temporary file in the cache directory, hashing
+# it on the way, so it can become a blob without ever being held in memory.
+# Failing to write (a full disk, a body over the cache's budget) only drops
+# the file: the stream itself goes on.
+class BlobWriter:
+  def __init__(self, directory: str, max_bytes: int):
+    os.makedirs(directory, exist_ok=True)
+    fd, self.path = tempfile.mkstemp(dir=directory, prefix=".tmp-")
+    self.file = os.fdopen(fd, "w+b")
+    self.max_bytes = max_bytes
+    self.hash = hashlib.sha256()
+    self.size = 0
+    self.blob: Optional[str] = None
+    self.failed = False
+
+  def write(self, chunk: bytes):
+    if self.failed:
+      return
+    self.size += len(chunk)
+    try:
+      if self.size > self.max_bytes:
+        raise OSError("Body exceeds the disk cache budget")
+      self.file.write(chunk)
+    except OSError:
+      self.discard()
+      return
+    self.hash.update(chunk)
+
+  # The blob name, or None if the body could not be written.
+  def finish(self) -> Optional[str]:
+    if self.failed or self.blob is not None:
+      return self.blob
+    try:
+      self.file.flush()
+      os.fsync(self.file.fileno())
+    except OSError:
+      self.discard()
+      return None
+    self.blob = self.hash.hexdigest()
+    return self.blob
+
+  def discard(self):
+    self.failed = True
+    self.blob = None
+    self.file.close()
+    try:
+      os.unlink(self.path)
+    except OSError:
+      pass
+
+# Bodies are stored once per content hash under `blobs/`, and `index.json`
+# maps each URL to its blob. Changes are appended to `journal.jsonl` and
+# folded into the index from time to time, so a write costs the same however
+# full the cache is. The index is only read on first use, so opening the
+# cache costs nothing until a request actually needs it.
+#
+# Several processes (render_batch workers) may share the directory: every
+# change is made under an exclusive lock on `lock`, after replaying what the
+# others journaled since.
+class DiskCache:
+  def __init__(self, directory: str, max_bytes: int):
+    self.directory = directory
+    self.max_bytes = max_bytes
+    # Least recently used first.
+    self.entries: Optional[OrderedDict[str, DiskCacheEntry]] = None
+    self.blob_refs: Dict[str, int] = dict()
+    self.total_bytes = 0
+    # URL -> last use, for reads not journaled yet. Reads only reorder the
+    # LRU, so they are written with the next change or at `flush`.
+    self.touched: Dict[str, float] = dict()
+    self.is_dirty = False
+    # How far this process has replayed the journal, and which file that
+    # was: compaction replaces the journal with a new, empty one.
+    self.journal_inode: Optional[int] = None
+    self.journal_offset = 0
+    self.journal_records = 0
+    self.lock = threading.Lock()
+    atexit.register(self.flush)
+
+  def _path(self, name: str) -> str:
+    return os.path.join(self.directory, name)
+
+  def _blob_path(self, blob: str) -> str:
+    return os.path.join(self.directory, BLOB_DIRECTORY, blob[:2], blob)
+
+  def _write_atomic(self, path: str, data: bytes):
+    # Write to a temporary file next to the target and rename it over, so a
+    # crash never leaves a truncated index or blob behind.
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".tmp-")
+    try:
+      with os.fdopen(fd, "wb") as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+      os.replace(tmp_path, path)
+    except BaseException:
+      try:
+        os.unlink(tmp_path)
+      except OSError:
+        pass
+      raise
+
+  @contextmanager
+  def _locked(self) -> Iterator[None]:
+    try:
+      os.makedirs(self.directory, exist_ok=True)
+      lock_file = open(self._path(LOCK_FILE), "ab")
+    except OSError:
+      # A read-only cache can still be read, without the lock.
+      lock_file = None
+    try:
+      if lock_file is not None and fcntl is not None:
+        fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+      self._sync()
+      yield
+    finally:
+      if lock_file is not None:
+        # Closing the file releases the lock.
+        lock_file.close()
+
+  def _sync(self):
+    try:
+      inode = os.stat(self._path(JOURNAL_FILE)).st_ino
+    except OSError:
+      inode = None
+    if self.entries is None or inode != self.journal_inode:
+      self._load(inode)
+    elif inode is not None:
+      self._replay()
+
+  def _load(self, journal_inode: Optional[int]):
+    self.entries = OrderedDict()
+    self.blob_refs = dict()
+    self.total_bytes = 0
+    self.journal_inode = journal_inode
+    self.journal_offset = 0
+    self.journal_records = 0
+    try:
+      with open(self._path(INDEX_FILE), "rb") as f:
+        raw = json.load(f)
+    except (OSError, ValueError):
+      raw = dict()
+    loaded = []
+    for url, raw_entry in raw.items():
+      try:
+        loaded.append((url, DiskCacheEntry.from_json(raw_entry)))
+      except (KeyError, TypeError):
+        continue
+    loaded.sort(key=lambda item: item[1].last_used)
+    for url, entry in loaded:
+      self._add_entry(url, entry)
+    if journal_inode is not None:
+      self._replay()
+    for url, last_used in self.touched.items():
+      self._touch(url, last_used)
+
+  def _replay(self):
+    try:
+      with open(self._path(JOURNAL_FILE), "rb") as f:
+        f.seek(self.journal_offset)
+        data = f.read()
+    except OSError:
+      return
+    # A record is complete once its newline is written.
+    end = data.rfind(b"\n") + 1
+    for line in data[:end].splitlines():
+      try:
+        self._apply(json.loads(line))
+      except (ValueError, KeyError, TypeError, IndexError):
+        continue
+      self.journal_records += 1
+    self.journal_offset += end
+
+  def _apply(self, record: Record):
+    # Blob files were already written or deleted by whoever journaled this.
+    op, url = record[0], record[1]
+    if op == "put":
+      if url in self.entries:
+        self._remove_entry(url, delete_blob=False)
+      self._add_entry(url, DiskCacheEntry.from_json(record[2]))
+    elif op == "remove":
+      if url in self.entries:
+        self._remove_entry(url, delete_blob=False)
+    elif op == "touch":
+      self._touch(url, record[2])
+    elif op == "update":
+      entry = self.entries.get(url)
+      if entry is not None:
+        entry.metadata = record[2]
+        self._touch(url, record[3])
+
+  def _touch(self, url: str, last_used: float):
+    entry = self.entries.get(url)
+    if entry is not None:
+      entry.last_used = max(entry.last_used, last_used)
+      self.entries.move_to_end(url)
+
+  def _append(self, records: List[Record]):
+    records = [["touch", url, last_used] for url, last_used in self.touched.items()
+               if url in self.entries] + records
+    self.touched.clear()
+    self.is_dirty = False
+    if not records:
+      return
+    # Not fsynced: a crash loses at most the last few records, and a torn
+    # last line is skipped on replay.
+    with open(self._path(JOURNAL_FILE), "ab") as f:
+      f.write(b"".join(json.dumps(record).encode("utf8") + b"\n" for record in records))
+      f.flush()
+      self.journal_offset = f.tell()
+      self.journal_inode = os.fstat(f.fileno()).st_ino
+    self.journal_records += len(records)
+    if self.journal_records >= max(COMPACT_RECORDS, len(self.entries)):
+      self._compact()
+
+  def _compact(self):
+    raw = {url: entry.to_json() for url, entry in self.entries.items()}
+    self._write_atomic(self._path(INDEX_FILE), json.dumps(raw).encode("utf8"))
+    # A crash before the new journal replaces the old one only replays
+    # records the index already holds.
+    self._write_atomic(self._path(JOURNAL_FILE), b"")
+    self.journal_inode = os.stat(self._path(JOURNAL_FILE)).st_ino
+    self.journal_offset = 0
+    self.journal_records = 0
+    self._delete_orphans()
+
+  def _delete_orphans(self):
+    # Blobs no entry refers to, e.g. left by a crash between writing a blob
+    # and journaling it. Blobs are only written under the lock, so nothing
+    # here is still being written.
+    temp = os.path.join(self.directory, TEMP_DIRECTORY)
+    now = time.time()
+    for name in os.listdir(temp) if os.path.isdir(temp) else []:
+      path = os.path.join(temp, name)
+      try:
+        if now - os.stat(path).st_mtime > TEMP_MAX_AGE:
+          os.unlink(path)
+      except OSError:
+        pass
+    blobs = os.path.join(self.directory, BLOB_DIRECTORY)
+    for prefix in os.listdir(blobs) if os.path.isdir(blobs) else []:
+      for blob in os.listdir(os.path.join(blobs, prefix)):
+        if blob not in self.blob_refs:
+          try:
+            os.unlink(os.path.join(blobs, prefix, blob))
+          except OSError:
+            pass
+
+  def _add_entry(self, url: str, entry: DiskCacheEntry):
+    self.entries[url] = entry
+    refs = self.blob_refs.get(entry.blob, 0)
+    if refs == 0:
+      self.total_bytes += entry.size
+    self.blob_refs[entry.blob] = refs + 1
+
+  def _remove_entry(self, url: str, delete_blob: bool = True):
+    entry = self.entries.pop(url)
+    self.touched.pop(url, None)
+    refs = self.blob_refs[entry.blob] - 1
+    if refs > 0:
+      self.blob_refs[entry.blob] = refs
+      return
+    self.blob_refs.pop(entry.blob)
+    self.total_bytes -= entry.size
+    if delete_blob:
+      try:
+        os.unlink(self._blob_path(entry.blob))
+      except OSError:
+        pass
+
+  def _evict(self) -> List[Record]:
+    records = []
+    while self.total_bytes > self.max_bytes and self.entries:
+      url = next(iter(self.entries))
+      self._remove_entry(url)
+      records.append(["remove", url])
+    return records
+
+  # Stale entries are returned as well; the caller decides whether to use,
+  # revalidate or `remove` them.
+  def get(self, url: str) -> Optional[Tuple[bytes, dict]]:
+    with self.lock:
+      with self._locked():
+        entry = self.entries.get(url)
+      if entry is None:
+        return None
+      try:
+        with open(self._blob_path(entry.blob), "rb") as f:
+          content = f.read()
+      except OSError:
+        self._remove_missing(url, entry.blob)
+        return None
+      last_used = time.time()
+      self._touch(url, last_used)
+      self.touched[url] = last_used
+      self.is_dirty = True
+      return content, entry.metadata
+
+  def _remove_missing(self, url: str, blob: str):
+    try:
+      with self._locked():
+        entry = self.entries.get(url)
+        if entry is not None and entry.blob == blob:
+          self._remove_entry(url)
+          self._append([["remove", url]])
+    except OSError:
+      pass
+
+  def put(self, url: str, content: bytes, metadata: dict):
+    if len(content) > self.max_bytes:
+      return
+    blob = hashlib.sha256(content).hexdigest()
+    with self.lock:
+      try:
+        with self._locked():
+          if url in self.entries:
+            self._remove_entry(url)
+          if blob not in self.blob_refs:
+            self._write_atomic(self._blob_path(blob), content)
+          entry = DiskCacheEntry(
+            blob=blob,
+            size=len(content),
+            metadata=metadata,
+            last_used=time.time(),
+          )
+          self._add_entry(url, entry)
+          self._append([["put", url, entry.to_json()]] + self._evict())
+      except OSError:
+        # The disk cache is an optimization; a read-only or full disk must
+        # not break page loads.
+        pass
+
+  def open_blob(self) -> Optional[BlobWriter]:
+    try:
+      return BlobWriter(os.path.join(self.directory, TEMP_DIRECTORY), self.max_bytes)
+    except OSError:
+      return None
+
+  # Stores a body streamed through `open_blob`. Takes the writer's file over,
+  # whether or not the body could be stored.
+  def put_blob(self, url: str, writer: BlobWriter, metadata: dict):
+    blob = writer.finish()
+    if blob is None:
+      return
+    writer.file.close()
+    with self.lock:
+      try:
+        with self._locked():
+          if url in self.entries:
+            self._remove_entry(url)
+          if blob in self.blob_refs:
+            os.unlink(writer.path)
+          else:
+            path = self._blob_path(blob)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            os.replace(writer.path, path)
+          entry = DiskCacheEntry(
+            blob=blob,
+            size=writer.size,
+            metadata=metadata,
+            last_used=time.time(),
+          )
+          self._add_entry(url, entry)
+          self._append([["put", url, entry.to_json()]] + self._evict())
+      except OSError:
+        writer.discard()
+
+  def update(self, url: str, metadata: dict):
+    with self.lock:
+      try:
+        with self._locked():
+          entry = self.entries.get(url)
+          if entry is None:
+            return
+          entry.metadata = metadata
+          self._touch(url, time.time())
+          self._append([["update", url, metadata, entry.last_used]])
+      except OSError:
+        pass
+
+  def remove(self, url: str):
+    with self.lock:
+      try:
+        with self._locked():
+          if url not in self.entries:
+            return
+          self._remove_entry(url)
+          self._append([["remove", url]])
+      except OSError:
+        pass
+
+  def flush(self):
+    with self.lock:
+      if self.entries is None or not self.is_dirty:
+        return
+      try:
+        with self._locked():
+          self._append([])
+      except OSError:
+        pass
+
+DISK_CACHE = DiskCache(directory=CACHE_DIRECTORY, max_bytes=CACHE_MAX_BYTES)
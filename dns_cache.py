@@ -0,0 +1,43 @@
+import socket
+import threading
+import time
+from typing import Dict, List, Tuple
+
+# `getaddrinfo` does not expose record TTLs, so every answer is kept for the
+# same fixed time.
+DEFAULT_TTL = 60.0
+
+AddressInfo = Tuple[int, int, int, str, tuple]
+
+class DNSCache:
+  def __init__(self, ttl: float = DEFAULT_TTL):
+    self.ttl = ttl
+    self.entries: Dict[Tuple[str, int], Tuple[float, List[AddressInfo]]] = dict()
+    self.lock = threading.Lock()
+    self.hits = 0
+    self.misses = 0
+
+  def resolve(self, host: str, port: int) -> List[AddressInfo]:
+    key = (host, port)
+    now = time.monotonic()
+    with self.lock:
+      entry = self.entries.get(key)
+      if entry is not None and entry[0] > now:
+        self.hits += 1
+        return entry[1]
+      self.misses += 1
+    addresses = socket.getaddrinfo(host, port, type=socket.SOCK_STREAM,
+                                   proto=socket.IPPROTO_TCP)
+    with self.lock:
+      self.entries[key] = (now + self.ttl, addresses)
+    return addresses
+
+  def forget(self, host: str, port: int):
+    with self.lock:
+      self.entries.pop((host, port), None)
+
+  def clear(self):
+    with self.lock:
+      self.entries.clear()
+
+DNS_CACHE = DNSCache()
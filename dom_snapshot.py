@@ -0,0 +1,192 @@
+import gc
+import hashlib
+import marshal
+import struct
+import threading
+from array import array
+from collections import OrderedDict
+from typing import Dict, Iterator, List, Optional, Tuple
+from body import Body
+from html_parser import Attributes, Element, Node, Text, create_html_parser
+
+SNAPSHOT_CACHE_MAX_BYTES = 32 * 1024 * 1024
+
+# Layout: a header with MAGIC and the byte sizes of the sections that follow,
+# then
+#   strings:    a marshalled tuple of every distinct tag, attribute and text
+#   kinds:      one byte per node in pre-order, TEXT_NODE or ELEMENT_NODE
+#   values:     per node, the string index of its text or tag
+#   parents:    per node, the pre-order index of its parent (the root has 0)
+#   attributes: a marshalled tuple with each element's attribute dict
+# marshal is only stable within one Python version, which is fine for a
+# cache that lives in the process.
+MAGIC = b"DOM\x02"
+HEADER = struct.Struct("<4sIIII")
+TEXT_NODE = 0
+ELEMENT_NODE = 1
+
+def serialize(root: Node) -> bytes:
+  strings: Dict[str, int] = dict()
+  kinds = array("B")
+  values = array("I")
+  parents = array("I")
+  attributes: List[Attributes] = []
+
+  def string_index(value: str) -> int:
+    index = strings.get(value)
+    if index is None:
+      index = strings[value] = len(strings)
+    return index
+
+  stack: List[Tuple[Node, int]] = [(root, 0)]
+  while stack:
+    node, parent_index = stack.pop()
+    index = len(kinds)
+    parents.append(parent_index)
+    if isinstance(node, Text):
+      kinds.append(TEXT_NODE)
+      values.append(string_index(node.text))
+      continue
+    kinds.append(ELEMENT_NODE)
+    values.append(string_index(node.tag))
+    attributes.append(node.attributes)
+    stack.extend((child, index) for child in reversed(node.children))
+
+  sections = [
+    marshal.dumps(tuple(strings)), kinds.tobytes(), values.tobytes(),
+    parents.tobytes(), marshal.dumps(tuple(attributes)),
+  ]
+  header = HEADER.pack(MAGIC, *(len(section) for section in sections[:4]))
+  return header + b"".join(sections)
+
+def deserialize(data: bytes) -> Node:
+  magic, *sizes = HEADER.unpack_from(data)
+  if magic != MAGIC:
+    raise ValueError("Not a DOM snapshot")
+  data = memoryview(data)
+  offset = HEADER.size
+  sections = []
+  for size in sizes:
+    sections.append(data[offset:offset + size])
+    offset += size
+  sections.append(data[offset:])
+  strings = marshal.loads(sections[0])
+  kinds = array("B", sections[1])
+  values = array("I")
+  values.frombytes(sections[2])
+  parents = array("I")
+  parents.frombytes(sections[3])
+  if not kinds or kinds[0] != ELEMENT_NODE:
+    raise ValueError("DOM snapshot has no root element")
+
+  # Building the tree only allocates objects that stay reachable, so cyclic
+  # garbage collection passes over them are wasted work.
+  is_gc_enabled = gc.isenabled()
+  gc.disable()
+  try:
+    attributes = iter(marshal.loads(sections[4]))
+    root = Element(strings[values[0]], next(attributes), None)
+    nodes: List[Node] = [root]
+    append = nodes.append
+    for kind, value, parent_index in zip(kinds[1:], values[1:], parents[1:]):
+      parent = nodes[parent_index]
+      if kind == TEXT_NODE:
+        node = Text(strings[value], parent)
+      else:
+        node = Element(strings[value], next(attributes), parent)
+      parent.children.append(node)
+      append(node)
+  finally:
+    if is_gc_enabled:
+      gc.enable()
+  return root
+
+# Serialized trees of recently parsed documents, keyed by a hash of the body
+# bytes, so loading an identical document skips tokenizing and tree building.
+class SnapshotCache:
+  def __init__(self, max_bytes: int = SNAPSHOT_CACHE_MAX_BYTES):
+    self.max_bytes = max_bytes
+    self.entries: OrderedDict[bytes, bytes] = OrderedDict()
+    self.total_bytes = 0
+    self.lock = threading.Lock()
+    self.hits = 0
+    self.misses = 0
+
+  def get(self, key: bytes) -> Optional[bytes]:
+    with self.lock:
+      data = self.entries.get(key)
+      if data is None:
+        self.misses += 1
+        return None
+      self.entries.move_to_end(key)
+      self.hits += 1
+      return data
+
+  def put(self, key: bytes, data: bytes):
+    if len(data) > self.max_bytes:
+      return
+    with self.lock:
+      previous = self.entries.pop(key, None)
+      if previous is not None:
+        self.total_bytes -= len(previous)
+      self.entries[key] = data
+      self.total_bytes += len(data)
+      while self.total_bytes > self.max_bytes:
+        _, evicted = self.entries.popitem(last=False)
+        self.total_bytes -= len(evicted)
+
+  def clear(self):
+    with self.lock:
+      self.entries.clear()
+      self.total_bytes = 0
+
+SNAPSHOT_CACHE = SnapshotCache()
+
+def _finish_key(digest, body: Body) -> bytes:
+  # The same bytes give a different tree under another charset or in view
+  # source.
+  digest.update((body.charset or "").encode("ascii", "replace"))
+  digest.update(b"\x01" if body.is_view_source else b"\x00")
+  return digest.digest()
+
+def snapshot_key(body: Body) -> bytes:
+  return _finish_key(hashlib.blake2b(body.raw, digest_size=16), body)
+
+# Hashes a streamed body's chunks on their way to the parser, so its
+# snapshot key is known once it is parsed without joining the body first.
+class HashedChunks:
+  def __init__(self, chunks: Iterator[bytes]):
+    self.chunks = iter(chunks)
+    self.digest = hashlib.blake2b(digest_size=16)
+    self.size = 0
+
+  def __iter__(self) -> Iterator[bytes]:
+    return self
+
+  def __next__(self) -> bytes:
+    chunk = next(self.chunks)
+    self.digest.update(chunk)
+    self.size += len(chunk)
+    return chunk
+
+def parse_document(body: Body) -> Node:
+  if body.raw_chunks is None:
+    # The bytes are already in memory, as for a body from the HTTP cache.
+    key = snapshot_key(body)
+    data = SNAPSHOT_CACHE.get(key)
+    if data is not None:
+      return deserialize(data)
+    size = len(body.raw)
+    root = create_html_parser(body=body).parse()
+  else:
+    # A body coming off the network is parsed as it arrives. Its snapshot
+    # serves the next load, which reads the body from the HTTP cache.
+    chunks = body.raw_chunks = HashedChunks(body.raw_chunks)
+    root = create_html_parser(body=body).parse()
+    key = _finish_key(chunks.digest, body)
+    size = chunks.size
+  # The snapshot of a body over the cache's budget would be too, and `put`
+  # would only throw it away.
+  if size <= SNAPSHOT_CACHE.max_bytes:
+    SNAPSHOT_CACHE.put(key, serialize(root))
+  return root
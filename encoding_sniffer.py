@@ -0,0 +1,72 @@
+import codecs
+import re
+from typing import Optional
+
+DEFAULT_ENCODING = "utf-8"
+# The HTML spec only looks at the first 1024 bytes for a `<meta charset>`.
+PRESCAN_SIZE = 1024
+
+BOMS = [
+  (codecs.BOM_UTF8, "utf-8-sig"),
+  (codecs.BOM_UTF16_LE, "utf-16"),
+  (codecs.BOM_UTF16_BE, "utf-16"),
+]
+
+# Labels that the Encoding Standard maps to a different decoder than the
+# Python codec of the same name.
+ENCODING_ALIASES = {
+  "ascii": "cp1252",
+  "us-ascii": "cp1252",
+  "iso-8859-1": "cp1252",
+  "iso8859-1": "cp1252",
+  "latin1": "cp1252",
+  "latin-1": "cp1252",
+}
+
+CONTENT_TYPE_CHARSET = re.compile(r"charset\s*=\s*[\"']?\s*([^\s;\"']+)", re.IGNORECASE)
+META_CHARSET = re.compile(
+  rb"<meta[^>]*?charset\s*=\s*[\"']?\s*([-\w.:]+)", re.IGNORECASE)
+
+def normalize_encoding(label: Optional[str]) -> Optional[str]:
+  if not label:
+    return None
+  label = label.strip().lower()
+  label = ENCODING_ALIASES.get(label, label)
+  try:
+    return codecs.lookup(label).name
+  except LookupError:
+    return None
+
+def charset_from_content_type(content_type: Optional[str]) -> Optional[str]:
+  if not content_type:
+    return None
+  match = CONTENT_TYPE_CHARSET.search(content_type)
+  if match is None:
+    return None
+  return normalize_encoding(match.group(1))
+
+def sniff_bom(prefix: bytes) -> Optional[str]:
+  for bom, encoding in BOMS:
+    if prefix.startswith(bom):
+      return encoding
+  return None
+
+def prescan_meta_charset(prefix: bytes) -> Optional[str]:
+  match = META_CHARSET.search(prefix[:PRESCAN_SIZE])
+  if match is None:
+    return None
+  encoding = normalize_encoding(match.group(1).decode("ascii", "replace"))
+  # A document that could be read far enough to find the meta is not UTF-16.
+  if encoding is not None and encoding.startswith("utf-16"):
+    return DEFAULT_ENCODING
+  return encoding
+
+def sniff_encoding(prefix: bytes, transport_charset: Optional[str] = None) -> str:
+  # Precedence follows the HTML spec: BOM, then the transport layer
+  # (Content-Type), then a `<meta>` prescan, then the default.
+  bom = sniff_bom(prefix)
+  if bom is not None:
+    return bom
+  if transport_charset is not None:
+    return transport_charset
+  return prescan_meta_charset(prefix) or DEFAULT_ENCODING
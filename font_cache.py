@@ -1,20 +1,239 @@
+import os
+from abc import ABC, abstractmethod
+from collections import OrderedDict
 from tkinter import Label
 from tkinter.font import Font
-from typing import Optional
+from typing import Dict, Optional, Tuple
+from character_set import SPACE
 from font_weight import Weight
+from glyph_widths import get_table
 from style import Style
+from text_run import AdvanceTable, Widths, is_long_run
 
-FONTS = {}
+MEASURE_CACHE_SIZE = 4096
+# Tk sizes are points; the glyph backend assumes a 96 dpi screen.
+PIXELS_PER_POINT = 96 / 72
 
-def get_font(size: int, weight: Weight, style: Style, family: Optional[str] = None) -> Font:
+# Round trips into Tk made by `CachedFont`, to check that layout stays off
+# the slow path.
+TK_CALLS = {"measure": 0, "metrics": 0}
+
+# Width cache shared by both kinds of font. Layout measures the same small
+# vocabulary again on every page and every resize, so each font keeps the
+# widths of its most recently measured strings.
+class WidthCache(ABC):
+  def _init_width_cache(self):
+    self.widths: OrderedDict[str, int] = OrderedDict()
+    self.hits = 0
+    self.misses = 0
+    self.advance_table: Optional[AdvanceTable] = None
+
+  @abstractmethod
+  def _measure(self, text: str) -> int:
+    pass
+
+  @abstractmethod
+  def _create_advance_table(self) -> AdvanceTable:
+    pass
+
+  def measure(self, text: str, displayof=None) -> int:
+    width = self.widths.get(text)
+    if width is None:
+      self.misses += 1
+      width = self._measure(text)
+      self.widths[text] = width
+      if len(self.widths) > MEASURE_CACHE_SIZE:
+        self.widths.popitem(last=False)
+    else:
+      self.hits += 1
+      self.widths.move_to_end(text)
+    return width
+
+  # The width of `word + trailing`, without building that string. Summing
+  # the parts ignores kerning across the boundary, which layout can afford.
+  def measure_word(self, word: str, trailing: str = "") -> int:
+    width = self.measure(word) if word else 0
+    if trailing == SPACE:
+      return width + self.space_width
+    if trailing:
+      width += self.measure(trailing)
+    return width
+
+  # `text.split()` and the width of each word. With NumPy, long runs are
+  # measured in one pass over their glyph advances, anything else word by
+  # word.
+  def word_widths(self, text: str) -> Widths:
+    if not is_long_run(text):
+      words = text.split()
+      return words, [self.measure(word) for word in words]
+    return self._get_advance_table().word_widths(text)
+
+  # `text.split("\n")` and the width of each line.
+  def line_widths(self, text: str) -> Widths:
+    if not is_long_run(text):
+      lines = text.split("\n")
+      return lines, [self.measure(line) if line else 0 for line in lines]
+    return self._get_advance_table().line_widths(text)
+
+  def _get_advance_table(self) -> AdvanceTable:
+    if self.advance_table is None:
+      self.advance_table = self._create_advance_table()
+    return self.advance_table
+
+# A Tk font. `measure` is a round trip into Tcl, so widths are cached, and
+# metrics never change for a font, so they are read once and kept as plain
+# fields.
+class CachedFont(WidthCache, Font):
+  def __init__(self, **options):
+    Font.__init__(self, **options)
+    self._init_width_cache()
+    # Tk only resolves a font for measuring once a widget uses it.
+    self.label = Label(font=self)
+    self.space_width: int = self._measure(SPACE)
+    metrics = self.metrics()
+    self.ascent: int = metrics["ascent"]
+    self.descent: int = metrics["descent"]
+    self.linespace: int = metrics["linespace"]
+
+  def _measure(self, text: str) -> int:
+    TK_CALLS["measure"] += 1
+    return Font.measure(self, text)
+
+  def measure(self, text: str, displayof=None) -> int:
+    if displayof is not None:
+      return Font.measure(self, text, displayof)
+    return WidthCache.measure(self, text)
+
+  def metrics(self, *options, **kw):
+    TK_CALLS["metrics"] += 1
+    return Font.metrics(self, *options, **kw)
+
+  # Long runs add up advances measured one character at a time, which can
+  # differ from measuring the word: by nothing where Tk's advances are whole
+  # pixels and unkerned (X11), by up to a pixel per character where they are
+  # fractional (macOS). Line boxes move only when that error pushes a word
+  # across the right edge.
+  def _create_advance_table(self) -> AdvanceTable:
+    return AdvanceTable(TkAdvances(self), 1)
+
+class TkAdvances(dict):
+  def __init__(self, font: CachedFont):
+    super().__init__()
+    self.font = font
+
+  def __missing__(self, character: str) -> int:
+    width = self[character] = self.font._measure(character)
+    return width
+
+# A font measured from the advance width tables in `glyph_widths`, with no
+# Tk involved: layout runs headless, and gives the same result everywhere.
+class GlyphFont(WidthCache):
+  def __init__(self, size: int, weight: Weight, slant: Style, family: Optional[str] = None):
+    self._init_width_cache()
+    self.size = size
+    self.weight = weight
+    self.slant = slant
+    self.family = family
+    self.name = f"glyph:{family or 'default'}:{size}:{weight}:{slant}"
+    self.table = get_table(family, weight)
+    # Negative Tk sizes are pixels.
+    pixels = -size if size < 0 else size * PIXELS_PER_POINT
+    self.scale = pixels / 1000
+    self.space_width: int = self._measure(SPACE)
+    self.ascent: int = round(self.table.ascent * self.scale)
+    self.descent: int = round(self.table.descent * self.scale)
+    self.linespace: int = self.ascent + self.descent
+
+  def _measure(self, text: str) -> int:
+    return round(sum(map(self.table.__getitem__, text)) * self.scale)
+
+  # Runs are summed in table units and rounded once, as `_measure` does, so
+  # they measure exactly what measuring each word would.
+  def _create_advance_table(self) -> AdvanceTable:
+    return AdvanceTable(self.table, self.scale)
+
+  def metrics(self, *options) -> dict | int:
+    metrics = {
+      "ascent": self.ascent, "descent": self.descent,
+      "linespace": self.linespace, "fixed": int(self.table.default_width == 600),
+    }
+    if len(options) == 1:
+      return metrics[options[0]]
+    return metrics
+
+  def __str__(self) -> str:
+    # A Tk font description, so a canvas can still draw with this font.
+    family = self.family or "Helvetica"
+    return f"{{{family}}} {self.size} {self.weight} {self.slant}"
+
+LayoutFont = CachedFont | GlyphFont
+
+# Creates the fonts handed to layout. Fonts from different backends measure
+# differently, so switching backends drops every font created so far.
+class MetricsBackend(ABC):
+  name = ""
+
+  @abstractmethod
+  def create_font(self, size: int, weight: Weight, style: Style,
+                  family: Optional[str]) -> LayoutFont:
+    pass
+
+class TkMetricsBackend(MetricsBackend):
+  name = "tk"
+
+  def create_font(self, size: int, weight: Weight, style: Style,
+                  family: Optional[str]) -> LayoutFont:
+    return CachedFont(size=size, weight=weight, slant=style, family=family)
+
+class GlyphMetricsBackend(MetricsBackend):
+  name = "glyph"
+
+  def create_font(self, size: int, weight: Weight, style: Style,
+                  family: Optional[str]) -> LayoutFont:
+    return GlyphFont(size, weight, style, family)
+
+BACKENDS: Dict[str, MetricsBackend] = {
+  backend.name: backend for backend in [TkMetricsBackend(), GlyphMetricsBackend()]
+}
+BACKEND: MetricsBackend = BACKENDS[os.environ.get("BROWSER_FONT_BACKEND", "tk")]
+
+FONTS: Dict[Tuple, LayoutFont] = {}
+# Font name -> the options it was created with, for serializing display lists
+# without asking Tk.
+FONT_DESCRIPTIONS = {}
+
+def set_backend(name: str):
+  global BACKEND
+  if name not in BACKENDS:
+    raise ValueError(f"Unknown font metrics backend: {name}")
+  BACKEND = BACKENDS[name]
+  FONTS.clear()
+  FONT_DESCRIPTIONS.clear()
+
+def get_font(size: int, weight: Weight, style: Style,
+             family: Optional[str] = None) -> LayoutFont:
   key = (size, weight, style, family)
-  if key not in FONTS:
-    font = Font(
-      size=size,
-      weight=weight,
-      slant=style,
-      family=family,
-    )
-    label = Label(font=font)
-    FONTS[key] = (font, label)
-  return FONTS[key][0]
\ No newline at end of file
+  font = FONTS.get(key)
+  if font is None:
+    font = FONTS[key] = BACKEND.create_font(size, weight, style, family)
+    FONT_DESCRIPTIONS[font.name] = {
+      "size": size, "weight": weight, "slant": style, "family": family,
+    }
+  return font
+
+def describe_font(font: LayoutFont) -> dict:
+  return FONT_DESCRIPTIONS[font.name]
+
+def measure_stats() -> dict:
+  hits = sum(font.hits for font in FONTS.values())
+  misses = sum(font.misses for font in FONTS.values())
+  total = hits + misses
+  return {
+    "backend": BACKEND.name,
+    "hits": hits,
+    "misses": misses,
+    "hit_rate": hits / total if total else 0.0,
+    "cached_strings": sum(len(font.widths) for font in FONTS.values()),
+    "tk_measure_calls": TK_CALLS["measure"],
+    "tk_metrics_calls": TK_CALLS["metrics"],
+  }
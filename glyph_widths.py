@@ -0,0 +1,77 @@
+import unicodedata
+from typing import Dict, List, Optional
+
+# Advance widths in 1/1000 em for the families layout asks for. The ASCII
+# tables are the standard Helvetica AFM metrics, which Arial shares, and
+# Courier's fixed 600. The default family (None) uses the Helvetica tables.
+
+FIRST_CHARACTER = 0x20
+
+def _ascii(widths: str) -> List[int]:
+  return [int(width) for width in widths.split()]
+
+# U+0020 .. U+007E
+HELVETICA = _ascii("""
+  278 278 355 556 556 889 667 191 333 333 389 584 278 333 278 278
+  556 556 556 556 556 556 556 556 556 556 278 278 584 584 584 556
+  1015 667 667 722 722 667 611 778 722 278 500 667 556 833 722 778
+  667 778 722 667 611 722 667 944 667 667 611 278 278 278 469 556
+  333 556 556 500 556 556 278 556 556 222 222 500 222 833 556 556
+  556 556 333 500 278 556 500 722 500 500 500 334 260 334 584
+""")
+HELVETICA_BOLD = _ascii("""
+  278 333 474 556 556 889 722 238 333 333 389 584 278 333 278 278
+  556 556 556 556 556 556 556 556 556 556 333 333 584 584 584 611
+  975 722 722 722 722 667 611 778 722 278 556 722 611 833 722 778
+  667 778 722 667 611 722 667 944 667 667 611 333 278 333 584 556
+  333 556 611 556 611 556 333 611 611 278 278 556 278 889 611 611
+  611 611 389 556 333 611 556 778 556 556 500 389 280 389 584
+""")
+COURIER = [600] * (0x7F - FIRST_CHARACTER)
+
+# Characters outside ASCII that pages commonly use.
+HELVETICA_EXTRA = {
+  "\u00A0": 278, "\u00AD": 0, "\u00A9": 737, "\u00AE": 737, "\u00B7": 278,
+  "\u2013": 556, "\u2014": 1000, "\u2018": 222, "\u2019": 222, "\u201C": 333,
+  "\u201D": 333, "\u2022": 350, "\u2026": 1000, "\u20AC": 556,
+}
+HELVETICA_BOLD_EXTRA = dict(HELVETICA_EXTRA, **{
+  "\u2018": 278, "\u2019": 278, "\u201C": 500, "\u201D": 500,
+})
+COURIER_EXTRA = {character: 600 for character in HELVETICA_EXTRA}
+COURIER_EXTRA["\u00AD"] = 0
+
+# Character -> width, filled in on first use for anything not in the tables.
+class GlyphTable(dict):
+  def __init__(self, ascii_widths: List[int], extra: Dict[str, int],
+               default_width: int, ascent: int, descent: int):
+    super().__init__(extra)
+    for offset, width in enumerate(ascii_widths):
+      self[chr(FIRST_CHARACTER + offset)] = width
+    self.default_width = default_width
+    self.ascent = ascent
+    self.descent = descent
+
+  def __missing__(self, character: str) -> int:
+    if unicodedata.combining(character) or unicodedata.category(character) in ("Mn", "Cf"):
+      width = 0
+    elif unicodedata.east_asian_width(character) in ("W", "F"):
+      width = 1000
+    else:
+      width = self.default_width
+    self[character] = width
+    return width
+
+# Vertical metrics in 1/1000 em, from Arial's and Courier New's hhea tables.
+TABLES = {
+  ("sans", "normal"): GlyphTable(HELVETICA, HELVETICA_EXTRA, 556, 905, 212),
+  ("sans", "bold"): GlyphTable(HELVETICA_BOLD, HELVETICA_BOLD_EXTRA, 611, 905, 212),
+  ("mono", "normal"): GlyphTable(COURIER, COURIER_EXTRA, 600, 833, 300),
+  ("mono", "bold"): GlyphTable(COURIER, COURIER_EXTRA, 600, 833, 300),
+}
+MONOSPACE_FAMILIES = frozenset(["courier", "courier new", "monospace", "tkfixedfont"])
+
+def get_table(family: Optional[str], weight: str) -> GlyphTable:
+  # Italic shares the upright widths, as Helvetica Oblique does.
+  kind = "mono" if family and family.casefold() in MONOSPACE_FAMILIES else "sans"
+  return TABLES[(kind, "bold" if weight == "bold" else "normal")]
@@ -1,11 +1,33 @@
-from typing import List, Tuple
+import re
+import sys
+from typing import Iterator, List, Optional, Tuple
 from body import Body
+from character_reference import decode_attribute
+from html_tokenizer import TEXT, Token, Tokenizer
 
+# Text nodes never have children; they all share this empty tuple.
+EMPTY_CHILDREN: Tuple = ()
+NON_SPACE = re.compile(r"\S")
+
+# Nodes use `__slots__`: a large page has hundreds of thousands of them and a
+# per-instance `__dict__` would dominate the size of the tree.
 class Text:
-  def __init__(self, text: str, parent):
-    self.text: str = text
-    self.children: List[Node] = []
+  __slots__ = ("source", "start", "end", "parent")
+  children = EMPTY_CHILDREN
+
+  # A text node is `source[start:end]`. The parser passes the document buffer
+  # itself as `source`, so the text is only copied out when it is read.
+  def __init__(self, source: str, parent, start: int = 0, end: Optional[int] = None):
+    self.source = source
+    self.start = start
+    self.end = len(source) if end is None else end
     self.parent: Node = parent
+
+  @property
+  def text(self) -> str:
+    if self.start == 0 and self.end == len(self.source):
+      return self.source
+    return self.source[self.start:self.end]
   
   def __repr__(self) -> str:
     return repr(self.text)
@@ -13,6 +35,8 @@ class Text:
 Attributes = dict[str, str]
 
 class Element:
+  __slots__ = ("tag", "children", "attributes", "parent")
+
   def __init__(self, tag: str, attributes: Attributes, parent):
     self.tag: str = tag
     self.children: List[Node] = []
@@ -25,62 +49,102 @@ class Element:
 Node = Text | Element
 Nodes = List[Node]
 
+# Insertion modes, after the HTML spec's tree construction stage. Only the
+# modes that add implicit tags are told apart; everything else is in body.
+BEFORE_HTML = "before html"
+BEFORE_HEAD = "before head"
+IN_HEAD = "in head"
+IN_BODY = "in body"
+
 class HTMLParser:
-  SELF_CLOSING_TAGS = [
+  SELF_CLOSING_TAGS = frozenset([
     "area", "base", "br", "col", "embed", "hr", "img", "input",
     "link", "meta", "param", "source", "track", "wbr",
-  ]
-  HEAD_TAGS = [
+  ])
+  HEAD_TAGS = frozenset([
     "base", "basefont", "bgsound", "noscript",
     "link", "meta", "title", "style", "script"
-  ]
-  BLOCK_TAGS = ["p", "li"]
-  LIST_OWNER_TAGS = ["ol", "ul"]
-  TEXT_FORMATTING_TAGS = ["b", "i"]
+  ])
+  BLOCK_TAGS = frozenset(["p", "li"])
+  LIST_OWNER_TAGS = frozenset(["ol", "ul"])
+  TEXT_FORMATTING_TAGS = frozenset(["b", "i"])
+  # Tags that close an open block element (`<p>a<p>b`).
+  BLOCK_CLOSING_TAGS = BLOCK_TAGS | LIST_OWNER_TAGS
+  BEFORE_HEAD_TAGS = frozenset(["head", "body", "/html"])
+  IN_HEAD_TAGS = HEAD_TAGS | {"/head"}
 
   def __init__(self, body: Body) -> None:
     self.body = body
     self.unfinished: List[Element] = []
+    # Open `b`/`i` elements, in stack order, so the innermost one is last.
+    self.open_formatting: List[Element] = []
+    self.mode = BEFORE_HTML
+    self.tokenizer = Tokenizer()
 
   def get_attributes(self, text: str) -> Tuple[str, Attributes]:
     parts = text.split()
-    tag = parts[0].casefold()
+    # Tag and attribute names repeat on every node; intern them so the tree
+    # holds one copy of each.
+    tag = sys.intern(parts[0].casefold())
     attributes = {}
     for attrpair in parts[1:]:
       if "=" in attrpair:
         key, value = attrpair.split("=", 1)
-        attributes[key.casefold()] = value
+        attributes[sys.intern(key.casefold())] = decode_attribute(value)
         if len(value) > 2 and value[0] in ["'", "\""]:
           value = value[1:-1]
       else:
-        attributes[attrpair.casefold()] = ""
+        attributes[sys.intern(attrpair.casefold())] = ""
     return tag, attributes
   
+  def _reset_insertion_mode(self):
+    # Implicit tags only matter while the stack is `[]`, `[html]` or
+    # `[html, head]`, so looking at its first two entries is enough.
+    unfinished = self.unfinished
+    depth = len(unfinished)
+    if depth == 0:
+      self.mode = BEFORE_HTML
+    elif depth == 1 and unfinished[0].tag == "html":
+      self.mode = BEFORE_HEAD
+    elif depth == 2 and unfinished[0].tag == "html" and unfinished[1].tag == "head":
+      self.mode = IN_HEAD
+    else:
+      self.mode = IN_BODY
+
   def add_implicit_tags(self, tag: str):
     while True:
-      open_tags = [node.tag for node in self.unfinished]
-      if open_tags == [] and tag != "html":
-        self.add_tag("html")
-      elif open_tags == ["html"] \
-           and tag not in ["head", "body", "/html"]:
+      mode = self.mode
+      if mode == IN_BODY:
+        break
+      if mode == BEFORE_HTML and tag != "html":
+        self.open_element("html", {})
+      elif mode == BEFORE_HEAD and tag not in self.BEFORE_HEAD_TAGS:
         if tag in self.HEAD_TAGS:
-          self.add_tag("head")
+          self.open_element("head", {})
         else:
-          self.add_tag("body")
-      elif open_tags == ["html", "head"] and \
-           tag not in ["/head"] + self.HEAD_TAGS:
-        self.add_tag("/head")
+          self.open_element("body", {})
+      elif mode == IN_HEAD and tag not in self.IN_HEAD_TAGS:
+        self.close_unfinished_tag()
       else:
         break
   
-  def add_text(self, text: str):
-    if text.isspace():
+  def add_text(self, text: str, start: int = 0, end: Optional[int] = None):
+    end = len(text) if end is None else end
+    if start < end and NON_SPACE.search(text, start, end) is None:
       return
     self.add_implicit_tags(None)
 
     parent = self.unfinished[-1]
-    node = Text(text, parent)
+    node = Text(text, parent, start, end)
     parent.children.append(node)
+
+  def open_element(self, tag: str, attributes: Attributes):
+    parent = self.unfinished[-1] if self.unfinished else None
+    node = Element(tag, attributes, parent)
+    self.unfinished.append(node)
+    if tag in self.TEXT_FORMATTING_TAGS:
+      self.open_formatting.append(node)
+    self._reset_insertion_mode()
   
   def close_unfinished_tag(self):
     if len(self.unfinished) == 1:
@@ -88,6 +152,14 @@ class HTMLParser:
     node = self.unfinished.pop()
     parent = self.unfinished[-1]
     parent.children.append(node)
+    if self.open_formatting and self.open_formatting[-1] is node:
+      self.open_formatting.pop()
+    self._reset_insertion_mode()
+
+  def current_formatting_element(self) -> Optional[Element]:
+    if self.open_formatting and self.open_formatting[-1] is self.unfinished[-1]:
+      return self.open_formatting[-1]
+    return None
   
   def add_tag(self, tag: str):
     if tag.startswith("!"):
@@ -101,21 +173,21 @@ class HTMLParser:
       return
 
     if tag.startswith("/"):
-      parent_tag = self.unfinished[-1].tag if self.unfinished else None
-      if parent_tag in self.TEXT_FORMATTING_TAGS \
-         and parent_tag != tag.split("/")[1]:
+      formatting = self.current_formatting_element()
+      if formatting is not None and formatting.tag != tag.split("/")[1]:
+        # Mis-nested `<b><p>..</b>..</p>`: close both and reopen a copy of
+        # the formatting element inside the parent.
         self.close_unfinished_tag()
         self.close_unfinished_tag()
-        self.add_tag(parent_tag)
+        self.add_implicit_tags(formatting.tag)
+        self.open_element(formatting.tag, dict(formatting.attributes))
       else:
         self.close_unfinished_tag()
     else:
-      parent = self.unfinished[-1] if self.unfinished else None
-      if parent and parent.tag in self.BLOCK_TAGS and \
-         (tag in self.BLOCK_TAGS or tag in self.LIST_OWNER_TAGS):
+      if self.unfinished and self.unfinished[-1].tag in self.BLOCK_TAGS and \
+         tag in self.BLOCK_CLOSING_TAGS:
         self.close_unfinished_tag()
-      node = Element(tag, attributes, parent)
-      self.unfinished.append(node)
+      self.open_element(tag, attributes)
 
   def finish(self) -> Node:
     if not self.unfinished:
@@ -124,64 +196,42 @@ class HTMLParser:
       node = self.unfinished.pop()
       parent = self.unfinished[-1]
       parent.children.append(node)
-    return self.unfinished.pop()
+    root = self.unfinished.pop()
+    self.open_formatting.clear()
+    self.mode = BEFORE_HTML
+    return root
 
-  def parse(self) -> Node:
-    in_tag = False
-    in_comment = False
-    in_script = False
-    in_attribute = False
-    index = 0
-    content = self.body.content
-    text = ""
-    while (index < content.__len__()):
-      c = content[index]
-      if in_script:
-        text += c
-        if text.endswith("</script>"):
-          text = ""
-          in_script = False
-      elif in_tag and in_comment:
-        text += c
-        if c == "\n" or text.endswith("-->"):
-          text = ""
-          in_tag = False
-          in_comment = False
-      elif c == "<" and not in_tag:
-        in_tag = True
-        if text:
-          self.add_text(text)
-        text = ""
-      elif c == ">" and in_tag and not in_attribute:
-        in_tag = False
-        if text.startswith("script"):
-          in_script = True
-        else:
-          self.add_tag(text)
-        text = ""
-      elif c == "\"" and in_tag:
-        in_attribute = not in_attribute
-      elif content.startswith("&lt;", index):
-        self.add_text("<")
-        index += 3
-      elif content.startswith("&gt;", index):
-        self.add_text(">")
-        index += 3
+  def _add_tokens(self, tokens: Iterator[Token]):
+    for kind, source, start, end in tokens:
+      if kind == TEXT:
+        self.add_text(source, start, end)
       else:
-        text += c
-        if text == "!--":
-          in_comment = True
-      
-      index += 1
-    if not in_tag and text:
-      self.add_text(text)
+        self.add_tag(source)
+
+  def feed(self, data: str):
+    # Between feeds `unfinished` holds the partial tree: the open elements,
+    # each with the children that were already closed.
+    self._add_tokens(self.tokenizer.feed(data))
+
+  def close(self) -> Node:
+    self._add_tokens(self.tokenizer.close())
     return self.finish()
 
+  def parse(self) -> Node:
+    for data in self.body.iter_content():
+      self.feed(data)
+    return self.close()
+
 class ViewSourceHTMLParser(HTMLParser):
-  def add_text(self, text: str):
+  def __init__(self, body: Body) -> None:
+    super().__init__(body)
+    super().add_tag("html")
+    super().add_tag("body")
+
+  def add_text(self, text: str, start: int = 0, end: Optional[int] = None):
     super().add_tag("pre")
     super().add_tag("b")
-    super().add_text(text)
+    super().add_text(text, start, end)
     super().add_tag("/b")
     super().add_tag("/pre")
 
@@ -190,11 +240,6 @@ class ViewSourceHTMLParser(HTMLParser):
       super().add_text(f"<{tag}>")
     else:
       super().add_text(f"<{tag}>")
-  
-  def parse(self) -> Node:
-    super().add_tag("html")
-    super().add_tag("body")
-    return super().parse()
 
 def create_html_parser(body: Body) -> HTMLParser:
   if body.is_view_source:
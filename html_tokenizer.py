@@ -0,0 +1,203 @@
+import re
+from character_reference import decode_text
+from typing import Iterator, List, Optional, Tuple
+
+TEXT = 0
+TAG = 1
+
+# (kind, source, start, end): the token's text is `source[start:end]`. Text
+# tokens point into the buffer being scanned rather than copying out of it,
+# so a text node can keep referring to the document it came from.
+Token = Tuple[int, str, int, int]
+
+# Raw text elements: their content is not scanned for tags. A script is
+# dropped entirely; a style keeps its content as a single text token.
+RAW_TEXT_END = {
+  "script": re.compile(r"</script\s*>", re.IGNORECASE),
+  "style": re.compile(r"</style\s*>", re.IGNORECASE),
+}
+TAG_NAME = re.compile(r"\s*([^\s/>]+)")
+TAG_END_OR_QUOTE = re.compile(r"[\">]")
+
+# What an incomplete construct at the end of the data waits for. Until a
+# chunk brings it, `feed` only searches the new data for it.
+TEXT_END = re.compile("<")
+TAG_END = re.compile(">")
+COMMENT_END = re.compile("-->|\n")
+ANY = re.compile(".", re.DOTALL)
+
+def _partial_end_tag(name: str) -> re.Pattern:
+  # Matches a start of `</name\s*>` that was cut short, such as `</scr`.
+  pattern = r"\s*"
+  for character in reversed("/" + name):
+    pattern = f"{re.escape(character)}(?:{pattern})?"
+  return re.compile(f"<(?:{pattern})?", re.IGNORECASE)
+
+RAW_TEXT_PARTIAL_END = {name: _partial_end_tag(name) for name in RAW_TEXT_END}
+
+def _text_token(content: str, start: int, end: int) -> Token:
+  # Only text with a `&` needs a decoded copy.
+  if content.find("&", start, end) < 0:
+    return TEXT, content, start, end
+  text = decode_text(content[start:end])
+  return TEXT, text, 0, len(text)
+
+def _comment_end(content: str, close_from: int, newline_from: int) -> int:
+  # A comment ends at `-->` or at the first newline, whichever comes first.
+  close = content.find("-->", close_from)
+  newline = content.find("\n", newline_from)
+  if close >= 0 and (newline < 0 or close + 2 < newline):
+    return close + 3
+  if newline >= 0:
+    return newline + 1
+  return -1
+
+def _scan_tag(content: str, start: int) -> Tuple[str, int]:
+  # Returns the tag text between `<` and `>` with double quotes removed
+  # (a `>` inside quotes does not close the tag), and the index after `>`.
+  parts = []
+  index = start + 1
+  while True:
+    match = TAG_END_OR_QUOTE.search(content, index)
+    if match is None:
+      return "", -1
+    position = match.start()
+    parts.append(content[index:position])
+    if match.group() == ">":
+      return "".join(parts), position + 1
+    close = content.find("\"", position + 1)
+    if close < 0:
+      return "", -1
+    parts.append(content[position + 1:close])
+    index = close + 1
+
+# Push-style tokenizer: `feed` yields the tokens that are complete so far
+# and keeps the rest (an open tag, comment, raw text element or the text run
+# before the next `<`) pending for the next chunk. Text runs are never split,
+# so feeding a document in pieces yields the same tokens as feeding it whole.
+# Tokens are produced lazily; consume them before feeding the next chunk.
+#
+# Pending data is kept as a list of chunks and only joined once a chunk brings
+# what the pending construct waits for, so a `<pre>` or `<script>` spread over
+# many chunks is scanned in linear time rather than rescanned on every feed.
+class Tokenizer:
+  def __init__(self):
+    self.pieces: List[str] = []
+    # What the pending data waits for, and the end of it that the next search
+    # must include, in case the terminator is split across chunks.
+    self.terminator: re.Pattern = ANY
+    self.partial: Optional[re.Pattern] = None
+    self.tail = ""
+    # A text run that starts with `!--` turns the *next* tag into a comment.
+    # This is how the character-by-character parser behaved, and the view
+    # source of test/4-8-1-lex-comment.html depends on it.
+    self.is_comment_pending = False
+
+  def feed(self, data: str) -> Iterator[Token]:
+    if self.pieces:
+      window = self.tail + data
+      self.pieces.append(data)
+      if self.terminator.search(window) is None:
+        self.tail = self._tail(window, 0)
+        return iter(())
+      data = "".join(self.pieces)
+      self.pieces = []
+    return self._scan(data, is_final=False)
+
+  def close(self) -> Iterator[Token]:
+    content = "".join(self.pieces)
+    self.pieces = []
+    yield from self._scan(content, is_final=True)
+    self.is_comment_pending = False
+
+  def _wait(self, content: str, index: int, terminator: re.Pattern, searched_from: int,
+            partial: Optional[re.Pattern] = None):
+    # Keeps `content[index:]` pending until `terminator` shows up; it is not
+    # in `content[searched_from:]`.
+    self.pieces = [content[index:]]
+    self.terminator = terminator
+    self.partial = partial
+    self.tail = self._tail(content, searched_from)
+
+  def _tail(self, content: str, start: int) -> str:
+    # The end of `content[start:]` that may be the start of the terminator.
+    if self.terminator is COMMENT_END:
+      return content[max(start, len(content) - 2):]
+    if self.partial is None:
+      return ""
+    # A cut off end tag has no `<` after its first character.
+    position = content.rfind("<", start)
+    if position >= 0 and self.partial.fullmatch(content, position):
+      return content[position:]
+    return ""
+
+  def _scan(self, content: str, is_final: bool) -> Iterator[Token]:
+    length = len(content)
+    index = 0
+    while index < length:
+      start = content.find("<", index)
+      if start < 0:
+        if is_final:
+          yield _text_token(content, index, length)
+        else:
+          self._wait(content, index, TEXT_END, length)
+        return
+      if start > index:
+        if content.startswith("!--", index):
+          self.is_comment_pending = True
+        yield _text_token(content, index, start)
+        index = start
+
+      if not is_final and not self.is_comment_pending and length < start + 4 \
+         and "!--".startswith(content[start + 1:]):
+        # Could still become `<!--`.
+        self._wait(content, start, ANY, length)
+        return
+      if self.is_comment_pending or content.startswith("!--", start + 1):
+        if self.is_comment_pending:
+          end = _comment_end(content, start, start + 1)
+        else:
+          end = _comment_end(content, start + 2, start + 4)
+        if end < 0:
+          # An unterminated comment swallows the rest of the document.
+          if not is_final:
+            self._wait(content, start, COMMENT_END, start + 1)
+          return
+        self.is_comment_pending = False
+        index = end
+        continue
+
+      tag, end = _scan_tag(content, start)
+      if end < 0:
+        # An unterminated tag swallows the rest of the document.
+        if not is_final:
+          self._wait(content, start, TAG_END, length)
+        return
+      if not tag:
+        index = end
+        continue
+      name = TAG_NAME.match(tag)
+      name = name.group(1).casefold() if name else ""
+      raw_text_end = RAW_TEXT_END.get(name)
+      if raw_text_end is None:
+        yield TAG, tag, 0, len(tag)
+        index = end
+        continue
+
+      match = raw_text_end.search(content, end)
+      if match is None and not is_final:
+        self._wait(content, start, raw_text_end, end, RAW_TEXT_PARTIAL_END[name])
+        return
+      raw_end = match.start() if match else length
+      if name != "script":
+        yield TAG, tag, 0, len(tag)
+        if raw_end > end:
+          yield TEXT, content, end, raw_end
+        close_tag = "/" + name
+        yield TAG, close_tag, 0, len(close_tag)
+      index = match.end() if match else length
+
+def tokenize(content: str) -> Iterator[Token]:
+  tokenizer = Tokenizer()
+  yield from tokenizer.feed(content)
+  yield from tokenizer.close()
@@ -1,9 +1,11 @@
+import math
 from abc import abstractmethod
+from bisect import bisect_left
+from itertools import accumulate
 from tkinter import Canvas
-import tkinter.font as tkfont 
 from typing import List, Optional
 import character_set
-from font_cache import get_font
+from font_cache import LayoutFont, describe_font, get_font
 from font_weight import DEFAULT_WEIGHT, Weight
 from html_parser import Element, Text, Node
 from style import DEFAULT_STYLE, Style
@@ -29,12 +31,12 @@ class LayoutMode(Enum):
     BLOCK = 2
 
 class DrawText:
-  def __init__(self, x1: int, y1: int, text: str, font: tkfont.Font) -> None:
+  def __init__(self, x1: int, y1: int, text: str, font: LayoutFont) -> None:
     self.top = y1
     self.left = x1
     self.text = text
     self.font = font
-    self.bottom = y1 + font.metrics("linespace")
+    self.bottom = y1 + font.linespace
 
   def execute(self, scroll: int, canvas: Canvas):
     canvas.create_text(
@@ -44,6 +46,12 @@ class DrawText:
       anchor="nw"
     )
 
+  def to_dict(self) -> dict:
+    return {
+      "type": "text", "x": self.left, "y": self.top, "text": self.text,
+      "font": describe_font(self.font),
+    }
+
 class DrawRect:
   def __init__(self, x1: int, y1: int, x2: int, y2: int, color: str) -> None:
     self.top = y1
@@ -60,6 +68,12 @@ class DrawRect:
       fill=self.color,
     )
 
+  def to_dict(self) -> dict:
+    return {
+      "type": "rect", "x1": self.left, "y1": self.top,
+      "x2": self.right, "y2": self.bottom, "color": self.color,
+    }
+
 Command = DrawText | DrawRect
 Commands = list[Command]
 
@@ -67,9 +81,9 @@ class DisplayItem:
   x: int
   y: int
   text: str
-  font: tkfont.Font
+  font: LayoutFont
 
-  def __init__(self, x: int, y: int, text: str, font: tkfont.Font):
+  def __init__(self, x: int, y: int, text: str, font: LayoutFont):
     self.x = x
     self.y = y
     self.text = text
@@ -87,10 +101,10 @@ class DisplayItem:
 class LineItem:
   x: int
   text: str
-  font: tkfont.Font
+  font: LayoutFont
   is_sup: bool
 
-  def __init__(self, x: int, text: str, font: tkfont.Font,
+  def __init__(self, x: int, text: str, font: LayoutFont,
                is_sup: bool = False):
     self.x = x
     self.text = text
@@ -127,29 +141,48 @@ class BlockLayout:
     self.style: Style = DEFAULT_STYLE
     self.is_pre: bool = False
     self.background: Optional[str] = background
+    self.mode: LayoutMode | None = None
+    # A dirty block rebuilds its children (or lines) on the next layout;
+    # clean blocks whose position and width did not change are skipped.
+    self.dirty: bool = True
+    self.dirty_descendants: bool = False
+    # Every line break decision stays the same for widths in
+    # (widest_fit, narrowest_break], so resizing within it keeps the lines.
+    self.widest_fit: int = 0
+    self.narrowest_break: float = math.inf
 
   def is_text_like_element(self, node: Node) -> bool:
     if isinstance(node, Text):
       return True
     return node.tag in TEXT_LIKE_ELEMENTS
 
-  def get_font(self) -> tkfont.Font:
+  def get_font(self) -> LayoutFont:
     return get_font(self.size, self.weight, self.style, family="Courier New" if self.is_pre else None)
 
-  def handle_word(self, word: str, trailing_character: str = character_set.SPACE):
+  # `width` is the width of `word` alone when the caller already measured it.
+  def handle_word(self, word: str, trailing_character: str = character_set.SPACE,
+                  width: Optional[int] = None):
     font = self.get_font()
-    word_and_space_width = font.measure(word + trailing_character)
+    if width is None:
+      word_and_space_width = font.measure_word(word, trailing_character)
+    else:
+      word_and_space_width = width + font.measure_word("", trailing_character)
     if self.cursor_x + word_and_space_width >= self.width:
       parts = word.split(character_set.SOFT_HYPHEN)
       if parts.__len__() > 1 and not self.is_sup:
+        # Where a word is hyphenated depends on the exact width.
+        self.narrowest_break = 0
+        hyphen_width = font.measure(character_set.HYPHEN)
         part_index = 0
         while True:
           candidate = ""
+          candidate_width = 0
           while part_index < len(parts):
-            if (self.cursor_x + font.measure(candidate + parts[part_index] + character_set.HYPHEN)
-                    >= self.width):
+            part_width = font.measure(parts[part_index])
+            if self.cursor_x + candidate_width + part_width + hyphen_width >= self.width:
               break
             candidate += parts[part_index]
+            candidate_width += part_width
             part_index += 1
           # TODO: We should check here. The `0` is right to compare?
           if not candidate and self.cursor_x == 0:
@@ -165,27 +198,56 @@ class BlockLayout:
             self.flush()
           else:
             self.line.append(LineItem(x=self.cursor_x, text=candidate, font=font))
-            self.cursor_x += font.measure(candidate + trailing_character)
+            self.cursor_x += candidate_width + font.measure_word("", trailing_character)
             return
-      else:
+      elif self.line:
+        self.narrowest_break = min(self.narrowest_break, self.cursor_x + word_and_space_width)
         self.flush()
+    else:
+      self.widest_fit = max(self.widest_fit, self.cursor_x + word_and_space_width)
     item = LineItem(x=self.cursor_x, text=word, font=font, is_sup=self.is_sup)
     self.line.append(item)
     self.cursor_x += word_and_space_width
 
+  # Lays out space separated words, as calling `handle_word` on each would.
+  # Prefix sums of the word widths find how many words still fit on the
+  # current line, and only the word that doesn't goes through `handle_word`.
+  def handle_words(self, words: List[str], widths: List[int]):
+    font = self.get_font()
+    space_width = font.space_width
+    ends = list(accumulate(width + space_width for width in widths))
+    index = 0
+    while index < len(words):
+      before = ends[index - 1] if index else 0
+      # A word overflows when cursor_x + its width reaches self.width.
+      stop = bisect_left(ends, self.width - self.cursor_x + before, index)
+      x = self.cursor_x - before
+      for fitting in range(index, stop):
+        self.line.append(LineItem(x=x + (ends[fitting - 1] if fitting else 0),
+                                  text=words[fitting], font=font, is_sup=self.is_sup))
+      if stop > index:
+        self.cursor_x = x + ends[stop - 1]
+        self.widest_fit = max(self.widest_fit, self.cursor_x)
+      if stop < len(words):
+        self.handle_word(words[stop], width=widths[stop])
+      index = stop + 1
+
   def flush(self):
     if not self.line:
       return
-    metrics = [font.metrics() for _, _, font in self.line]
-    max_ascent = max([metric["ascent"] for metric in metrics])
+    # Long lines hold many words but only a few fonts. Tk fonts compare by
+    # value and are not hashable, so they are told apart by identity; the
+    # font cache hands out one object per font anyway.
+    fonts = {id(item.font): item.font for item in self.line}.values()
+    max_ascent = max([font.ascent for font in fonts])
     # TODO: This is a simple implementation. We need to consider variant fonts.
     baseline = self.cursor_y + LEADING_RATIO * max_ascent
+    # Positions are relative to the block, so moving it keeps its lines.
     for item in self.line:
-      (rel_x, word, font) = item
-      x = self.x + rel_x
-      y = self.y + (baseline - font.metrics("ascent") if not item.is_sup else self.cursor_y)
-      self.display_list.append(DisplayItem(x=x, y=y, text=word, font=font))
-    max_descent = max([metric["descent"] for metric in metrics])
+      font = item.font
+      y = baseline - font.ascent if not item.is_sup else self.cursor_y
+      self.display_list.append(DisplayItem(x=item.x, y=y, text=item.text, font=font))
+    max_descent = max([font.descent for font in fonts])
     self.cursor_y = baseline + 1.25 * max_descent
     self.cursor_x = 0
     self.line = []
@@ -264,6 +326,9 @@ class BlockLayout:
     elif tag == "li":
       self.flush()
     elif tag == "h1":
+      if self.line:
+        # Centering depends on the exact width.
+        self.narrowest_break = 0
       line_len = self.line.__len__()
       line_width = (self.cursor_x - self.line[0].x) if line_len else 0
       start_x = (self.width - line_width) / 2
@@ -288,14 +353,13 @@ class BlockLayout:
       if self.is_abbr:
         self.abbr_buffer += root.text
       elif self.is_pre:
-        splitted = root.text.split("\n")
+        splitted, widths = self.get_font().line_widths(root.text)
         for index, line in enumerate(splitted):
-          self.handle_word(word=line)
+          self.handle_word(word=line, width=widths[index])
           if index + 1 < len(splitted):
             self.flush()
       else:
-        for word in root.text.split():
-          self.handle_word(word=word)
+        self.handle_words(*self.get_font().word_widths(root.text))
     else:
       self.handle_open_tag(root.tag)
       for child in root.children:
@@ -363,27 +427,60 @@ class BlockLayout:
     self.height = sum([
         child.height for child in self.children])
 
-  def layout(self):
-    self.set_constraints()
-    mode = self.layout_mode()
-    if mode == LayoutMode.BLOCK:
+  # The DOM under this block changed: its children and lines are rebuilt on
+  # the next layout.
+  def mark_dirty(self):
+    self.dirty = True
+    parent = self.parent
+    while isinstance(parent, BlockLayout) and not parent.dirty_descendants:
+      parent.dirty_descendants = True
+      parent = parent.parent
+
+  # Creates the child layout objects, which then survive until the DOM
+  # changes.
+  def build(self):
+    self.children = []
+    self.mode = self.layout_mode()
+    if self.mode == LayoutMode.BLOCK:
       self.convert_nodes_to_layout_object(previous=None)
-    else:
-      self.cursor_x: int = 0
-      self.cursor_y: int = 0
-      self.is_sup: bool = False
-      self.is_abbr: bool = False
-      self.abbr_buffer = ""
-      self.line: Line = []
-      for node in self.nodes:
-        self.recurse(root=node)
-      self.flush()
 
-      self.height = self.cursor_y
+  def break_lines(self):
+    self.display_list = []
+    self.size = 12
+    self.weight = DEFAULT_WEIGHT
+    self.style = DEFAULT_STYLE
+    self.is_pre = False
+    self.widest_fit = 0
+    self.narrowest_break = math.inf
+    self.cursor_x: int = 0
+    self.cursor_y: int = 0
+    self.is_sup: bool = False
+    self.is_abbr: bool = False
+    self.abbr_buffer = ""
+    self.line: Line = []
+    for node in self.nodes:
+      self.recurse(root=node)
+    self.flush()
+
+    self.height = self.cursor_y
+
+  def layout(self):
+    x, y, width = self.x, self.y, self.width
+    self.set_constraints()
+    if not (self.dirty or self.dirty_descendants) and \
+       (x, y, width) == (self.x, self.y, self.width):
+      return
+    if self.dirty:
+      self.build()
+    if self.mode == LayoutMode.INLINE and \
+       (self.dirty or not self.widest_fit < self.width <= self.narrowest_break):
+      self.break_lines()
+    self.dirty = False
+    self.dirty_descendants = False
 
     self.layout_children()
 
-    if mode == LayoutMode.BLOCK:
+    if self.mode == LayoutMode.BLOCK:
       self.compute_height()
   
   def paint(self) -> Commands:
@@ -392,9 +489,9 @@ class BlockLayout:
       commands.append(
           DrawRect(x1=self.x, y1=self.y, x2=self.x + self.width, y2=self.y + self.height,
                    color=self.background))
-    if self.layout_mode() == LayoutMode.INLINE:
+    if self.mode == LayoutMode.INLINE:
       for x, y, word, font in self.display_list:
-        commands.append(DrawText(x1=x, y1=y, text=word, font=font))
+        commands.append(DrawText(x1=self.x + x, y1=self.y + y, text=word, font=font))
     return commands
 
   def __repr__(self) -> str:
@@ -409,7 +506,8 @@ class ListItemLayout(BlockLayout):
     text = DrawText(x1=self.x, y1=self.y, text=self.MARKER_SYMBOL, font=font)
     commands: Commands = [text]
     for x, y, word, font in self.display_list:
-      commands.append(DrawText(x1=marker_width + x, y1=y, text=word, font=font))
+      commands.append(DrawText(x1=marker_width + self.x + x, y1=self.y + y, text=word,
+                               font=font))
     return commands
 
   def __repr__(self) -> str:
@@ -433,16 +531,15 @@ class TOCLayout(BlockLayout):
   def is_toc_layout(node: Node) -> bool:
     return node.tag == "nav" and "id" in node.attributes.keys() and node.attributes["id"] == "toc"
 
-  def layout(self):
-    self.set_constraints()
+  def build(self):
     assert(len(self.nodes) == 1)
+    self.children = []
+    self.mode = LayoutMode.BLOCK
     text = Text(self.TOC_TEXT, self.nodes[0])
     text_layout = create_layout_object(nodes=[text], parent=self, previous=None, background="gray")
     self.children.append(text_layout)
 
     self.convert_nodes_to_layout_object(previous=text_layout)
-    self.layout_children()
-    self.compute_height()
 
 class DocumentLayout:
   def __init__(self, viewport_width: int, node: Node):
@@ -455,9 +552,14 @@ class DocumentLayout:
     self.width: int | None = None
     self.height: int | None = None
 
-  def layout(self):
-    child = create_layout_object(nodes=[self.node], parent=self, previous=None)
-    self.children.append(child)
+  # Laying out again, e.g. for a new viewport width, reuses the layout tree:
+  # see `BlockLayout.layout`.
+  def layout(self, viewport_width: Optional[int] = None):
+    if viewport_width is not None:
+      self.viewport_width = viewport_width
+    if not self.children:
+      self.children.append(create_layout_object(nodes=[self.node], parent=self, previous=None))
+    child = self.children[0]
     self.width = self.viewport_width - 2 * HSTEP
     self.x = HSTEP
     self.y = VSTEP
@@ -0,0 +1,113 @@
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional, Set, Tuple
+from cache import Cache
+
+MEMORY_CACHE_MAX_BYTES = 32 * 1024 * 1024
+MAX_REDIRECTS = 1024
+
+CacheKey = Tuple[str, Tuple[str, ...]]
+
+def parse_vary(value: Optional[str]) -> List[str]:
+  if not value:
+    return []
+  return sorted(name.strip().casefold() for name in value.split(",") if name.strip())
+
+# One cache for every `URL` in the process. Entries are keyed by the URL plus
+# the request header values its `Vary` names, and the least recently used
+# entries are dropped once the byte budget is exceeded.
+class ResponseCache:
+  def __init__(self, max_bytes: int = MEMORY_CACHE_MAX_BYTES):
+    self.max_bytes = max_bytes
+    self.entries: OrderedDict[CacheKey, Tuple[Cache, int]] = OrderedDict()
+    self.vary: Dict[str, List[str]] = dict()
+    self.variants: Dict[str, Set[CacheKey]] = dict()
+    self.redirects: OrderedDict[str, str] = OrderedDict()
+    self.total_bytes = 0
+    self.lock = threading.RLock()
+    self.hits = 0
+    self.misses = 0
+    self.evictions = 0
+
+  def _key(self, url: str, vary: List[str], request_headers: Dict[str, str]) -> CacheKey:
+    headers = {key.casefold(): value for key, value in request_headers.items()}
+    return url, tuple(headers.get(name, "") for name in vary)
+
+  def _size(self, cache: Cache) -> int:
+    return len(cache.body.raw)
+
+  def get(self, url: str, request_headers: Dict[str, str]) -> Optional[Cache]:
+    with self.lock:
+      vary = self.vary.get(url)
+      entry = None
+      if vary is not None:
+        key = self._key(url, vary, request_headers)
+        entry = self.entries.get(key)
+      if entry is None:
+        self.misses += 1
+        return None
+      self.entries.move_to_end(key)
+      self.hits += 1
+      return entry[0]
+
+  def put(self, url: str, cache: Cache, request_headers: Dict[str, str]):
+    size = self._size(cache)
+    if size > self.max_bytes:
+      return
+    vary = parse_vary(cache.headers.get("vary"))
+    with self.lock:
+      if self.vary.get(url, vary) != vary:
+        # The server changed what it varies on; older variants are unusable.
+        self.remove(url)
+      key = self._key(url, vary, request_headers)
+      self._remove_key(key)
+      self.vary[url] = vary
+      self.entries[key] = (cache, size)
+      self.variants.setdefault(url, set()).add(key)
+      self.total_bytes += size
+      while self.total_bytes > self.max_bytes:
+        self._remove_key(next(iter(self.entries)))
+        self.evictions += 1
+
+  def _remove_key(self, key: CacheKey):
+    entry = self.entries.pop(key, None)
+    if entry is None:
+      return
+    self.total_bytes -= entry[1]
+    url = key[0]
+    variants = self.variants[url]
+    variants.discard(key)
+    if not variants:
+      self.variants.pop(url)
+      self.vary.pop(url, None)
+
+  def remove(self, url: str):
+    with self.lock:
+      for key in list(self.variants.get(url, [])):
+        self._remove_key(key)
+      self.vary.pop(url, None)
+
+  def get_redirect(self, url: str) -> Optional[str]:
+    with self.lock:
+      location = self.redirects.get(url)
+      if location is not None:
+        self.redirects.move_to_end(url)
+      return location
+
+  def put_redirect(self, url: str, location: str):
+    # Only permanent redirects (301, 308) may be remembered.
+    with self.lock:
+      self.redirects[url] = location
+      self.redirects.move_to_end(url)
+      while len(self.redirects) > MAX_REDIRECTS:
+        self.redirects.popitem(last=False)
+
+  def clear(self):
+    with self.lock:
+      self.entries.clear()
+      self.vary.clear()
+      self.variants.clear()
+      self.redirects.clear()
+      self.total_bytes = 0
+
+MEMORY_CACHE = ResponseCache()
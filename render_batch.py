@@ -0,0 +1,124 @@
+import argparse
+import json
+import os
+import sys
+import time
+import traceback
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import IO, Iterator, List, Optional
+from constant import WIDTH
+from font_cache import BACKENDS, set_backend
+from html_parser import create_html_parser
+from layout import Commands, DocumentLayout, paint_tree
+from resource_timing import TimingCollector
+from url import URL
+
+# Renders many pages without a window: fetch -> parse -> layout -> paint in
+# a pool of worker processes, writing one JSON line per input, in input
+# order, as results arrive.
+
+def start_worker(font_backend: str):
+  set_backend(font_backend)
+  if font_backend == "tk":
+    # Tk fonts need an interpreter (and a display) in every worker process.
+    import tkinter
+    window = tkinter.Tk()
+    window.withdraw()
+
+def render(index: int, url: str, viewport_width: int) -> dict:
+  result = {"index": index, "url": url}
+  timings = {}
+  try:
+    # A response body streams into the parser, so "fetch" ends with the
+    # headers and "parse" includes the download; the body size is known
+    # once parsing has read it all.
+    with TimingCollector() as collector:
+      start = time.perf_counter()
+      body = URL(url).request()
+      timings["fetch"] = time.perf_counter() - start
+
+      start = time.perf_counter()
+      root = create_html_parser(body=body).parse()
+      timings["parse"] = time.perf_counter() - start
+    result["bytes"] = collector.entries[-1].decoded_body_size
+
+    start = time.perf_counter()
+    document = DocumentLayout(viewport_width=viewport_width, node=root)
+    document.layout()
+    timings["layout"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    commands: Commands = []
+    paint_tree(document, commands)
+    display_list = [command.to_dict() for command in commands]
+    timings["paint"] = time.perf_counter() - start
+
+    result["height"] = document.height
+    result["display_list"] = display_list
+  except Exception as e:
+    # One broken page must not take the batch down with it.
+    result["error"] = f"{type(e).__name__}: {e}"
+    result["traceback"] = traceback.format_exc()
+  result["timings"] = timings
+  return result
+
+def read_inputs(urls: List[str], input_path: Optional[str]) -> List[str]:
+  inputs = list(urls)
+  if input_path:
+    f = sys.stdin if input_path == "-" else open(input_path)
+    try:
+      inputs.extend(line.strip() for line in f if line.strip() and not line.startswith("#"))
+    finally:
+      if f is not sys.stdin:
+        f.close()
+  return inputs
+
+def render_all(urls: List[str], workers: Optional[int] = None,
+               viewport_width: int = WIDTH, font_backend: str = "glyph") -> Iterator[dict]:
+  with ProcessPoolExecutor(max_workers=workers, initializer=start_worker,
+                           initargs=(font_backend,)) as executor:
+    futures: List[Future] = [
+      executor.submit(render, index, url, viewport_width) for index, url in enumerate(urls)]
+    for index, future in enumerate(futures):
+      try:
+        yield future.result()
+      except BrokenProcessPool as e:
+        # A worker died (crash, OOM kill); its document and any still queued
+        # are reported instead of aborting the stream.
+        yield {"index": index, "url": urls[index], "error": f"BrokenProcessPool: {e}",
+               "timings": {}}
+
+def write_jsonl(results: Iterator[dict], output: IO[str]) -> int:
+  failures = 0
+  for result in results:
+    if "error" in result:
+      failures += 1
+    output.write(json.dumps(result, ensure_ascii=False))
+    output.write("\n")
+    output.flush()
+  return failures
+
+def main() -> int:
+  parser = argparse.ArgumentParser(description="Render pages to display lists as JSONL.")
+  parser.add_argument("urls", nargs="*")
+  parser.add_argument("--input", metavar="PATH", help="file with one URL per line, - for stdin")
+  parser.add_argument("--output", metavar="PATH", help="JSONL output (default stdout)")
+  parser.add_argument("--workers", type=int, default=os.cpu_count())
+  parser.add_argument("--width", type=int, default=WIDTH, help="viewport width")
+  parser.add_argument("--font-backend", choices=sorted(BACKENDS), default="glyph",
+                      help="text metrics: bundled glyph tables (headless) or Tk")
+  args = parser.parse_args()
+
+  urls = read_inputs(args.urls, args.input)
+  output = open(args.output, "w") if args.output else sys.stdout
+  try:
+    failures = write_jsonl(render_all(urls, args.workers, args.width, args.font_backend), output)
+  finally:
+    if output is not sys.stdout:
+      output.close()
+  print(f"Rendered {len(urls) - failures}/{len(urls)} documents", file=sys.stderr)
+  return 1 if failures else 0
+
+if __name__ == "__main__":
+  sys.exit(main())
@@ -1,10 +1,19 @@
+from typing import Dict, Optional
+
+DEFAULT_HEADERS = {
+  "User-Agent": "MinseongBrowser/1.0",
+  "Connection": "keep-alive",
+  "Accept-Encoding": "gzip",
+}
+
 class RequestHeader:
-  def __init__(self, path: str, host: str):
+  def __init__(self, path: str, host: str, extra_headers: Optional[Dict[str, str]] = None):
     self.request = f"GET {path} HTTP/1.1\r\n"
     self._append("Host", host)
-    self._append("User-Agent", "MinseongBrowser/1.0")
-    self._append("Connection", "keep-alive")
-    self._append("Accept-Encoding", "gzip")
+    for key, value in DEFAULT_HEADERS.items():
+      self._append(key, value)
+    for key, value in (extra_headers or {}).items():
+      self._append(key, value)
     self.request += "\r\n"
 
   def _append(self, key, value):
@@ -0,0 +1,82 @@
+import time
+from typing import Callable, List, Optional
+
+CACHE_MISS = "miss"
+CACHE_HIT = "hit"
+CACHE_REVALIDATED = "revalidated"
+
+# Timestamps are `time.perf_counter()` values, the `*_duration` fields are
+# seconds, and the field names follow the Resource Timing API. Connection
+# phases stay `None` when a pooled connection was reused.
+class ResourceTiming:
+  def __init__(self, name: str):
+    self.name = name
+    self.start_time: float = time.perf_counter()
+    self.domain_lookup_start: Optional[float] = None
+    self.domain_lookup_end: Optional[float] = None
+    self.connect_start: Optional[float] = None
+    self.connect_end: Optional[float] = None
+    self.secure_connection_start: Optional[float] = None
+    self.request_start: Optional[float] = None
+    self.response_start: Optional[float] = None
+    self.response_end: Optional[float] = None
+    self.decompress_duration: float = 0.0
+    self.decode_duration: float = 0.0
+    self.connection_reused = False
+    self.cache_state = CACHE_MISS
+    self.redirect_count = 0
+    self.response_status: Optional[int] = None
+    self.transfer_size = 0
+    self.encoded_body_size = 0
+    self.decoded_body_size = 0
+    self.is_finished = False
+
+  @property
+  def duration(self) -> Optional[float]:
+    if self.response_end is None:
+      return None
+    return self.response_end - self.start_time
+
+  def finish(self):
+    if self.is_finished:
+      return
+    self.is_finished = True
+    if self.response_end is None:
+      self.response_end = time.perf_counter()
+    for observer in list(OBSERVERS):
+      observer(self)
+
+  def to_dict(self) -> dict:
+    return {key: value for key, value in vars(self).items() if key != "is_finished"}
+
+  def __repr__(self) -> str:
+    return f"ResourceTiming: {self.name} cache={self.cache_state} duration={self.duration}"
+
+Observer = Callable[[ResourceTiming], None]
+OBSERVERS: List[Observer] = []
+
+def add_observer(observer: Observer):
+  OBSERVERS.append(observer)
+
+def remove_observer(observer: Observer):
+  OBSERVERS.remove(observer)
+
+def start_timing(name: str) -> Optional[ResourceTiming]:
+  # Nothing is measured unless someone is listening.
+  if not OBSERVERS:
+    return None
+  return ResourceTiming(name)
+
+class TimingCollector:
+  def __init__(self):
+    self.entries: List[ResourceTiming] = []
+
+  def __call__(self, timing: ResourceTiming):
+    self.entries.append(timing)
+
+  def __enter__(self):
+    add_observer(self)
+    return self
+
+  def __exit__(self, *_):
+    remove_observer(self)
@@ -0,0 +1,99 @@
+import codecs
+import time
+import zlib
+from typing import Iterable, Iterator, Optional
+from resource_timing import ResourceTiming
+
+READ_SIZE = 64 * 1024
+
+def iter_chunked(response) -> Iterator[bytes]:
+  while True:
+    # 청크 크기 라인 읽기 (예: b'1a3\r\n' 또는 b'1a3;extension=... \r\n')
+    line = response.readline()
+    if not line:
+      raise RuntimeError("Unexpected EOF while reading chunk size")
+    # strip CRLF and whitespace
+    line_str = line.strip().decode("utf8")
+    # chunk-size may have extensions after ';' -> split
+    size_str = line_str.split(";", 1)[0]
+    try:
+      chunk_size = int(size_str, 16)
+    except ValueError:
+      raise RuntimeError(f"Invalid chunk size line: {line_str!r}")
+
+    if chunk_size == 0:
+      # 마지막 청크. 이후 트레일러 헤더(있다면) 읽고 끝
+      # 읽다가 빈 줄(b'\r\n') 나오면 끝
+      while True:
+        trailer_line = response.readline()
+        if not trailer_line or trailer_line == b"\r\n":
+          return
+        # (필요하면 트레일러를 파싱할 수 있음)
+
+    # 큰 청크도 READ_SIZE 단위로 나눠서 내보낸다.
+    yield from iter_content_length(response, chunk_size)
+    # 청크 끝의 CRLF 소비
+    crlf = response.read(2)
+    if crlf != b"\r\n":
+      raise RuntimeError("Missing CRLF after chunk data")
+
+def iter_content_length(response, length: int) -> Iterator[bytes]:
+  remaining = length
+  while remaining > 0:
+    data = response.read1(min(remaining, READ_SIZE))
+    if not data:
+      raise RuntimeError("Unexpected EOF while reading body")
+    remaining -= len(data)
+    yield data
+
+def iter_until_eof(response) -> Iterator[bytes]:
+  while True:
+    data = response.read1(READ_SIZE)
+    if not data:
+      return
+    yield data
+
+def iter_gunzip(chunks: Iterable[bytes],
+                timing: Optional[ResourceTiming] = None) -> Iterator[bytes]:
+  # `16 + MAX_WBITS` makes zlib expect a gzip header and trailer.
+  decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+  for chunk in chunks:
+    while chunk:
+      if timing is not None:
+        start = time.perf_counter()
+        data = decompressor.decompress(chunk, READ_SIZE)
+        timing.decompress_duration += time.perf_counter() - start
+      else:
+        data = decompressor.decompress(chunk, READ_SIZE)
+      if data:
+        yield data
+      if decompressor.eof:
+        # A gzip stream may hold several members back to back.
+        chunk = decompressor.unused_data
+        if chunk:
+          decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+      elif decompressor.unconsumed_tail:
+        chunk = decompressor.unconsumed_tail
+      else:
+        chunk = b""
+  data = decompressor.flush()
+  if data:
+    yield data
+
+def iter_decode(chunks: Iterable[bytes], encoding: str, errors: str = "strict",
+                timing: Optional[ResourceTiming] = None) -> Iterator[str]:
+  # The incremental decoder holds back a multi-byte sequence that is split
+  # across two chunks until the rest of it arrives.
+  decoder = codecs.getincrementaldecoder(encoding)(errors)
+  for chunk in chunks:
+    if timing is not None:
+      start = time.perf_counter()
+      text = decoder.decode(chunk)
+      timing.decode_duration += time.perf_counter() - start
+    else:
+      text = decoder.decode(chunk)
+    if text:
+      yield text
+  text = decoder.decode(b"", final=True)
+  if text:
+    yield text
@@ -3,4 +3,13 @@ class Status:
     self.code = int(code)
 
   def is_redirect(self) -> bool:
-    return 300 <= self.code < 400
+    return 300 <= self.code < 400 and not self.is_not_modified()
+
+  def is_not_modified(self) -> bool:
+    return self.code == 304
+
+  def has_body(self) -> bool:
+    return not (100 <= self.code < 200 or self.code in [204, 304])
+
+  def is_permanent_redirect(self) -> bool:
+    return self.code in [301, 308]
@@ -0,0 +1,79 @@
+from typing import List, Mapping, Tuple
+
+try:
+  import numpy
+except ImportError:
+  numpy = None
+
+# Measures whole text runs in one NumPy pass over their glyph advances,
+# instead of one cached `measure` call per word. Without NumPy fonts keep
+# measuring word by word: a pure Python pass over every character is
+# several times slower than hashing each word into the width cache.
+
+# Code points whose advances are looked up from a dense array; anything
+# above is looked up one character at a time.
+DENSE_SIZE = 0x100
+# Shorter runs are cheaper to measure word by word from the width cache.
+MIN_RUN_LENGTH = 256
+
+Widths = Tuple[List[str], List[int]]
+
+def is_long_run(text: str) -> bool:
+  return numpy is not None and len(text) >= MIN_RUN_LENGTH
+
+class AdvanceTable:
+  # `advances` maps a character to its advance width, in whatever unit the
+  # font uses; a run's width is its advances' sum times `scale`, rounded, the
+  # same rounding a font applies when measuring the run as one string.
+  def __init__(self, advances: Mapping[str, int], scale: float):
+    self.advances = advances
+    self.scale = scale
+    self.dense = numpy.array(
+      [advances[chr(code)] for code in range(DENSE_SIZE)], dtype=numpy.int32)
+    self.dense_space = numpy.array([chr(code).isspace() for code in range(DENSE_SIZE)])
+    # The advances of the whitespace between words are zeroed, so summing
+    # from one word's start to the next one's gives the word's width.
+    self.dense_words = numpy.where(self.dense_space, 0, self.dense)
+    self.dense_lines = self.dense.copy()
+    self.dense_lines[ord("\n")] = 0
+
+  def _advances(self, text: str, dense_advances, is_zero) -> Tuple:
+    # Python strings index by code point, so UTF-32 units line up with them.
+    codes = numpy.frombuffer(text.encode("utf-32-le"), dtype=numpy.uint32)
+    dense = codes < DENSE_SIZE
+    # One extra zero, so an empty last line can start at len(text).
+    advances = numpy.zeros(len(codes) + 1, dtype=numpy.int32)
+    advances[:-1] = dense_advances[numpy.where(dense, codes, 0)]
+    if not dense.all():
+      for index in numpy.flatnonzero(~dense).tolist():
+        character = text[index]
+        advances[index] = 0 if is_zero(character) else self.advances[character]
+    return codes, advances
+
+  def _widths(self, advances, starts) -> List[int]:
+    sums = numpy.add.reduceat(advances, starts, dtype=numpy.int64)
+    # `rint` rounds half to even, like `round`.
+    return numpy.rint(sums * self.scale).astype(numpy.int64).tolist()
+
+  def word_widths(self, text: str) -> Widths:
+    # `text.split()` and the width of each word.
+    words = text.split()
+    if not words:
+      return words, []
+    codes, advances = self._advances(text, self.dense_words, str.isspace)
+    space = advances == 0
+    space[:-1] = self.dense_space[numpy.where(codes < DENSE_SIZE, codes, 0)]
+    for index in numpy.flatnonzero(codes >= DENSE_SIZE).tolist():
+      space[index] = text[index].isspace()
+    # A word starts at text after whitespace, or at the start of the run.
+    starts = numpy.flatnonzero(space[:-2] & ~space[1:-1]) + 1
+    if not space[0]:
+      starts = numpy.concatenate(([0], starts))
+    return words, self._widths(advances, starts)
+
+  def line_widths(self, text: str) -> Widths:
+    # `text.split("\n")` and the width of each line.
+    lines = text.split("\n")
+    codes, advances = self._advances(text, self.dense_lines, "\n".__eq__)
+    starts = numpy.concatenate(([0], numpy.flatnonzero(codes == ord("\n")) + 1))
+    return lines, self._widths(advances, starts)
@@ -0,0 +1,57 @@
+import socket
+import ssl
+import threading
+from typing import Dict, Optional, Tuple
+
+_context: Optional[ssl.SSLContext] = None
+_context_lock = threading.Lock()
+
+def get_ssl_context() -> ssl.SSLContext:
+  # Creating a context loads the whole CA store, so do it once per process.
+  global _context
+  with _context_lock:
+    if _context is None:
+      _context = ssl.create_default_context()
+    return _context
+
+class TLSSessionCache:
+  def __init__(self):
+    self.sessions: Dict[Tuple[str, int], ssl.SSLSession] = dict()
+    self.lock = threading.Lock()
+    self.handshakes = 0
+    self.resumptions = 0
+
+  def wrap(self, sock: socket.socket, host: str, port: int) -> ssl.SSLSocket:
+    with self.lock:
+      session = self.sessions.get((host, port))
+    try:
+      tls_socket = get_ssl_context().wrap_socket(
+        sock, server_hostname=host, session=session)
+    except ssl.SSLError:
+      # Do not offer a session the server choked on to the next connection.
+      self.forget(host, port)
+      raise
+    with self.lock:
+      self.handshakes += 1
+      if tls_socket.session_reused:
+        self.resumptions += 1
+    self.remember(tls_socket, host, port)
+    return tls_socket
+
+  def remember(self, tls_socket: ssl.SSLSocket, host: str, port: int):
+    # With TLS 1.3 the ticket only arrives after the handshake, once some
+    # application data has been read, so this is called again on release.
+    try:
+      session = tls_socket.session
+    except (OSError, ValueError):
+      return
+    if session is None or not session.has_ticket and not session.id:
+      return
+    with self.lock:
+      self.sessions[(host, port)] = session
+
+  def forget(self, host: str, port: int):
+    with self.lock:
+      self.sessions.pop((host, port), None)
+
+TLS_SESSIONS = TLSSessionCache()
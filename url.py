@@ -1,19 +1,36 @@
-import socket
-import ssl
+import mmap
 import os
 import time
-import gzip
-from typing import Dict
-from body import Body
+from typing import Dict, Iterator, Optional, Tuple
+from body import Body, RawContent
 from cache import Cache
-from cache_control import CacheControl
-from request_header import RequestHeader
+from connection_pool import POOL, Connection
+from disk_cache import DISK_CACHE
+from encoding_sniffer import charset_from_content_type
+from memory_cache import MEMORY_CACHE
+from request_header import DEFAULT_HEADERS, RequestHeader
+from resource_timing import CACHE_HIT, CACHE_REVALIDATED, ResourceTiming, start_timing
+from response_stream import iter_chunked, iter_content_length, iter_gunzip, iter_until_eof
 from status import Status
 
+MMAP_THRESHOLD = 4 * 1024 * 1024
+
+def read_file(f, size: int) -> RawContent:
+  if size < MMAP_THRESHOLD:
+    f.seek(0)
+    return f.read()
+  # Large documents are mapped instead of read: pages are faulted in as
+  # `Body.iter_content` walks the file window by window, and they live in
+  # the OS page cache rather than as a copy on the Python heap. The mapping
+  # outlives the file being closed, renamed or deleted.
+  mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+  if hasattr(mmap, "MADV_SEQUENTIAL"):
+    mapped.madvise(mmap.MADV_SEQUENTIAL)
+  return memoryview(mapped)
+
 class URL:
   def __init__(self, url: str):
-    self.caches: Dict[str, Cache] = dict()
-    self.socket = None
+    self.url = url
     self.is_view_source = False
     if url.startswith("data:"):
       self.scheme, url = url.split(":", 1)
@@ -60,7 +77,7 @@ class URL:
     assert(self.port)
     return f"{self.scheme}://{self.host}:{self.port}/{self.path}"
 
-  def _open_file_path(self, allowed_root: str = None) -> str:
+  def _open_file_path(self, allowed_root: str = None) -> RawContent:
     if allowed_root:
       allowed_root = os.path.realpath(allowed_root)
       if not os.path.commonpath([allowed_root, self.path]) == allowed_root:
@@ -72,7 +89,7 @@ class URL:
       raise IsADirectoryError(self.path)
 
     with open(self.path, "rb") as f:
-      return f.read().decode("utf8")
+      return read_file(f, os.fstat(f.fileno()).st_size)
 
   def _resolve_location(self, location: str) -> str:
     # already absolute URL (has scheme)
@@ -96,138 +113,270 @@ class URL:
       joined = f"{base_dir}/{location}"
     return f"{self.scheme}://{self.host}:{self.port}/{joined}"
 
-  def _read_chunked(self, response) -> bytes:
-    body = b""
+  def _send_request(self, extra_headers: Optional[Dict[str, str]] = None,
+                    timing: Optional[ResourceTiming] = None) -> Tuple[Connection, bytes]:
+    header = RequestHeader(path=self.path, host=self.host, extra_headers=extra_headers)
     while True:
-      # 청크 크기 라인 읽기 (예: b'1a3\r\n' 또는 b'1a3;extension=... \r\n')
-      line = response.readline()
-      if not line:
-        raise RuntimeError("Unexpected EOF while reading chunk size")
-      # strip CRLF and whitespace
-      line_str = line.strip().decode("utf8")
-      # chunk-size may have extensions after ';' -> split
-      if ";" in line_str:
-        size_str = line_str.split(";", 1)[0]
-      else:
-        size_str = line_str
+      connection = POOL.acquire(self.scheme, self.host, self.port, timing)
       try:
-        chunk_size = int(size_str, 16)
-      except ValueError:
-        raise RuntimeError(f"Invalid chunk size line: {line_str!r}")
-
-      if chunk_size == 0:
-        # 마지막 청크. 이후 트레일러 헤더(있다면) 읽고 끝
-        # 읽다가 빈 줄(b'\r\n') 나오면 끝
-        while True:
-          trailer_line = response.readline()
-          if not trailer_line:
-            break
-          if trailer_line == b"\r\n":
-            break
-          # (필요하면 트레일러를 파싱할 수 있음)
-        break
+        if timing is not None:
+          timing.request_start = time.perf_counter()
+        connection.send(header.encode())
+        statusline = connection.response.readline()
+        if timing is not None:
+          timing.response_start = time.perf_counter()
+        if not statusline:
+          raise ConnectionError("Connection closed before status line")
+        return connection, statusline
+      except OSError:
+        POOL.discard(connection)
+        # A pooled socket may have been closed by the server while idle.
+        # Retry on another one; a fresh connection failing is a real error.
+        if not connection.is_reused:
+          raise
 
-      # 지정된 바이트만큼 읽음. read()는 정확히 chunk_size 바이트를 반환할 때까지 블로킹.
-      chunk = response.read(chunk_size)
-      if len(chunk) < chunk_size:
-        raise RuntimeError("Unexpected EOF while reading chunk data")
-      body += chunk
-      # 청크 끝의 CRLF 소비
-      crlf = response.read(2)
-      if crlf != b"\r\n":
-        # 일부 서버가 CRLF를 다르게 줄 수 있으니 관대하게 처리하거나 오류로 본다.
-        # 여기서는 오류로 처리.
-        raise RuntimeError("Missing CRLF after chunk data")
-    return body
-
-  def request(self, redirect_count: int = 0) -> Body:
-    if self.scheme == "file":
-      return Body(content=self._open_file_path())
-    elif self.scheme == "data":
-      return Body(content=self.data)
+  def _iter_body(self, response, status: Status,
+                 response_headers: Dict[str, str]) -> Iterator[bytes]:
+    if not status.has_body():
+      return iter(())
+    content_length = response_headers.get("content-length")
+    transfer_encoding = response_headers.get("transfer-encoding")
+    if transfer_encoding and "chunked" in transfer_encoding.lower():
+      return iter_chunked(response)
+    elif content_length:
+      return iter_content_length(response, int(content_length))
+    else:
+      return iter_until_eof(response)
 
-    # TODO: Move cache to local file?
-    url = self._get_url()
-    cache = self.caches.get(url)
-    if not cache is None:
-      if cache.expired_at > time.time():
-        return cache.body
+  def _stream_body(self, connection: Connection, version: bytes, status: Status,
+                   response_headers: Dict[str, str],
+                   timing: Optional[ResourceTiming]) -> Iterator[bytes]:
+    # The socket goes back to the pool only once the body is fully read.
+    try:
+      chunks = self._iter_body(connection.response, status, response_headers)
+      if timing is None:
+        yield from chunks
       else:
-        self.caches.pop(url)
+        # Every hop adds to `transfer_size`, but `encoded_body_size`
+        # describes the final response, as in `AsyncFetcher._request`.
+        size = 0
+        for chunk in chunks:
+          size += len(chunk)
+          yield chunk
+        timing.response_end = time.perf_counter()
+        timing.encoded_body_size = size
+        timing.transfer_size += size
+    except BaseException:
+      POOL.discard(connection)
+      raise
+    if self._is_reusable(version, status, response_headers):
+      POOL.release(connection)
+    else:
+      POOL.discard(connection)
+
+  def _measure_decoded(self, chunks: Iterator[bytes],
+                       timing: ResourceTiming) -> Iterator[bytes]:
+    for chunk in chunks:
+      timing.decoded_body_size += len(chunk)
+      yield chunk
+
+  def _cache_on_completion(self, url: str, chunks: Iterator[bytes],
+                           response_headers: Dict[str, str],
+                           request_time: float, response_time: float) -> Iterator[bytes]:
+    # Chunks are written to a blob file as they pass, so caching never holds
+    # a copy of the body; the memory cache entry is then read back from it.
+    writer = DISK_CACHE.open_blob()
+    finished = False
+    try:
+      for chunk in chunks:
+        if writer is not None:
+          writer.write(chunk)
+        yield chunk
+      finished = True
+    finally:
+      if writer is not None and not finished:
+        writer.discard()
+    if writer is None or writer.finish() is None:
+      return
+    try:
+      raw_body = read_file(writer.file, writer.size)
+    except OSError:
+      writer.discard()
+      return
+    cache = self._create_cache(raw_body, response_headers, request_time, response_time)
+    MEMORY_CACHE.put(url, cache, DEFAULT_HEADERS)
+    DISK_CACHE.put_blob(url, writer, cache.metadata())
+
+  def _create_cache(self, raw_body: RawContent, response_headers: Dict[str, str],
+                    request_time: float, response_time: float) -> Cache:
+    return Cache(
+      body=Body(
+        raw=raw_body,
+        charset=charset_from_content_type(response_headers.get("content-type")),
+      ),
+      headers=response_headers,
+      request_time=request_time,
+      response_time=response_time,
+    )
+
+  def store_cache(self, url: str, raw_body: bytes, response_headers: Dict[str, str],
+                  request_time: float, response_time: float) -> Cache:
+    cache = self._create_cache(raw_body, response_headers, request_time, response_time)
+    MEMORY_CACHE.put(url, cache, DEFAULT_HEADERS)
+    DISK_CACHE.put(url, raw_body, cache.metadata())
+    return cache
+
+  def invalidate_cache(self, url: str):
+    MEMORY_CACHE.remove(url)
+    DISK_CACHE.remove(url)
 
-    if self.socket is None:
-      self.socket = socket.socket(
-        family=socket.AF_INET,
-        type=socket.SOCK_STREAM,
-        proto=socket.IPPROTO_TCP,
+  def _is_reusable(self, version: bytes, status: Status,
+                   response_headers: Dict[str, str]) -> bool:
+    connection = response_headers.get("connection", "").lower()
+    if "close" in connection:
+      return False
+    if version == b"HTTP/1.0" and "keep-alive" not in connection:
+      return False
+    if not status.has_body():
+      return True
+    transfer_encoding = response_headers.get("transfer-encoding")
+    if transfer_encoding and "chunked" in transfer_encoding.lower():
+      return True
+    # Without a length the body runs until EOF, so the socket is spent.
+    return "content-length" in response_headers
+
+  def lookup_cache(self, url: str) -> Optional[Cache]:
+    cache = MEMORY_CACHE.get(url, DEFAULT_HEADERS)
+    if cache is None:
+      cached = DISK_CACHE.get(url)
+      if cached is None:
+        return None
+      content, metadata = cached
+      headers = metadata["headers"]
+      cache = Cache(
+        body=Body(
+          raw=content,
+          charset=charset_from_content_type(headers.get("content-type")),
+        ),
+        headers=headers,
+        request_time=metadata["request_time"],
+        response_time=metadata["response_time"],
       )
-      self.socket.connect((self.host, self.port))
-      if (self.scheme == "https"):
-        ctx = ssl.create_default_context()
-        self.socket = ctx.wrap_socket(self.socket, server_hostname=self.host)
+      # The disk cache is keyed by URL alone. That is only sound for `Vary`
+      # because every request sends the same DEFAULT_HEADERS.
+      MEMORY_CACHE.put(url, cache, DEFAULT_HEADERS)
+    # A stale entry is only useful if it can be revalidated.
+    if not cache.is_fresh() and not cache.has_validators() and not cache.can_serve_stale():
+      self.invalidate_cache(url)
+      return None
+    return cache
+
+  def _follow(self, location: str, redirect_count: int,
+              timing: Optional[ResourceTiming]) -> Body:
+    is_view_source = self.is_view_source
+    self.__init__(location)
+    self.is_view_source = is_view_source
+    if timing is not None:
+      timing.redirect_count += 1
+    return self.request(redirect_count=redirect_count + 1, timing=timing)
+
+  def _from_cache(self, cache: Cache, timing: Optional[ResourceTiming],
+                  cache_state: str = CACHE_HIT) -> Body:
+    if timing is not None:
+      timing.cache_state = cache_state
+      timing.decoded_body_size = len(cache.body.raw)
+      timing.finish()
+    return cache.body.with_view_source(self.is_view_source)
 
-    header = RequestHeader(path=self.path, host=self.host)
-    self.socket.send(header.encode())
+  def request(self, redirect_count: int = 0,
+              timing: Optional[ResourceTiming] = None) -> Body:
+    if timing is None and redirect_count == 0:
+      timing = start_timing(self.url)
+    if self.scheme == "file":
+      raw = self._open_file_path()
+      if timing is not None:
+        timing.encoded_body_size = timing.decoded_body_size = len(raw)
+        timing.response_end = time.perf_counter()
+      return Body(raw=raw, is_view_source=self.is_view_source, timing=timing)
+    elif self.scheme == "data":
+      if timing is not None:
+        timing.encoded_body_size = timing.decoded_body_size = len(self.data.encode("utf8"))
+        timing.response_end = time.perf_counter()
+      return Body(content=self.data, timing=timing)
 
-    # TODO: Replace hardcoded encoding by parsing header `Content-Type`
-    response = self.socket.makefile("rb")
+    url = self._get_url()
+    location = MEMORY_CACHE.get_redirect(url)
+    if location is not None and redirect_count < 5:
+      return self._follow(location, redirect_count, timing)
 
-    statusline = response.readline()
-    print(f"statusline: {statusline}")
-    version, status_code, explanation = statusline.split(b" ", 2)
+    cache = self.lookup_cache(url)
+    if not cache is None and cache.is_fresh():
+      return self._from_cache(cache, timing)
+
+    request_time = time.time()
+    validators = cache.validators() if cache else None
+    try:
+      connection, statusline = self._send_request(extra_headers=validators, timing=timing)
+    except OSError:
+      if not cache is None and cache.can_serve_stale():
+        return self._from_cache(cache, timing)
+      raise
+    response = connection.response
+    version, status_code, _ = statusline.split(b" ", 2)
     status = Status(code=status_code)
-    print(">>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>")
-    print(f"version: {version}")
-    print(f"status: {status}")
-    print(f"explanation: {explanation}")
 
     response_headers = {}
+    header_size = len(statusline)
     while True:
       line = response.readline()
+      header_size += len(line)
       if line == b"\r\n":
         break
       header, value = line.split(b":", 1)
       header = header.decode("utf8")
       value = value.decode("utf8")
       response_headers[header.casefold()] = value.strip()
-      print(f"{header}: {value}")
+    if timing is not None:
+      timing.response_status = status.code
+      timing.transfer_size += header_size
+
+    response_time = time.time()
+    raw_chunks = self._stream_body(connection, version, status, response_headers, timing)
+
+    if status.is_not_modified() and not cache is None:
+      for _ in raw_chunks:
+        pass
+      cache.refresh(response_headers, request_time, response_time)
+      DISK_CACHE.update(url, cache.metadata())
+      return self._from_cache(cache, timing, cache_state=CACHE_REVALIDATED)
 
     if redirect_count < 5 and status.is_redirect():
       location = response_headers.get("location")
       if location is None:
         raise RuntimeError("Redirect status, but no Location header")
       location = self._resolve_location(location)
-      try:
-        self.socket.close()
-        self.socket = None
-      except Exception:
+      # Drain the redirect body so the socket can be reused for the next hop.
+      for _ in raw_chunks:
         pass
-      self.__init__(location)
-      return self.request(redirect_count=redirect_count + 1)
+      if status.is_permanent_redirect() and Cache.is_redirect_storable(response_headers):
+        MEMORY_CACHE.put_redirect(url, location)
+      return self._follow(location, redirect_count, timing)
 
-    content_length = response_headers.get("content-length")
-    transfer_encoding = response_headers.get("transfer-encoding")
     content_encoding = response_headers.get("content-encoding")
-    
-    if transfer_encoding and "chunked" in transfer_encoding.lower():
-      raw_body = self._read_chunked(response)
-    elif content_length:
-      raw_body = response.read(int(content_length))
-    else:
-      raw_body = response.read()
-
     if content_encoding == "gzip":
-      raw_body = gzip.decompress(raw_body)
-
-    body = Body(content=raw_body.decode("utf8"), is_view_source=self.is_view_source)
+      raw_chunks = iter_gunzip(raw_chunks, timing)
+    if timing is not None:
+      raw_chunks = self._measure_decoded(raw_chunks, timing)
 
-    cache_control_raw = response_headers.get("cache-control")
-    if not cache_control_raw is None:
-      cache_control = CacheControl(raw=cache_control_raw)
-      if not cache_control.no_store and cache_control.max_age > 0:
-        self.caches[url] = Cache(
-          body=body, 
-          max_age=cache_control.max_age
-        )
+    if Cache.is_storable(status.code, response_headers):
+      raw_chunks = self._cache_on_completion(
+        url, raw_chunks, response_headers, request_time, response_time)
+    elif not cache is None:
+      self.invalidate_cache(url)
 
-    return body
\ No newline at end of file
+    return Body(
+      raw_chunks=raw_chunks,
+      charset=charset_from_content_type(response_headers.get("content-type")),
+      is_view_source=self.is_view_source,
+      timing=timing,
+    )
@@ -0,0 +1,142 @@
+import re
+from array import array
+from bisect import bisect_left, bisect_right
+from typing import Dict, Iterator, List, Tuple
+from body import Body
+from font_cache import get_font
+from font_weight import DEFAULT_WEIGHT
+from layout import HSTEP, VSTEP, Commands, DrawText
+from style import DEFAULT_STYLE
+
+# `<[^<>]*>` rather than `<[^>]*>` so a stray `<` can't make each search run
+# to the end of the document.
+MARKUP = re.compile(r"<!--.*?-->|<[^<>]*>", re.DOTALL)
+FONT_FAMILY = "Courier New"
+# Lines above and below the viewport that are painted too.
+OVERSCAN = 5
+
+BLOCK_SIZE = 64 * 1024
+
+Segment = Tuple[str, bool]
+
+# Renders `view-source:` pages straight from the source text instead of
+# building a DOM for them. Opening a page only counts newlines per block;
+# line offsets and markup are located when a line is painted, and only the
+# lines near the viewport become draw commands.
+class ViewSource:
+  def __init__(self, body: Body, size: int = 12):
+    self.text = body.content
+    # block_lines[b] is the number of newlines before block b.
+    self.block_lines = array("L", [0])
+    for start in range(0, len(self.text), BLOCK_SIZE):
+      self.block_lines.append(
+        self.block_lines[-1] + self.text.count("\n", start, start + BLOCK_SIZE))
+    self.line_count = self.block_lines[-1] + 1
+    # Block index -> offsets of the newlines in it, for blocks painted so far.
+    self.block_newlines: Dict[int, array] = dict()
+    # Markup is drawn in the regular face and text in bold, as the DOM based
+    # view source did.
+    self.font = get_font(size, DEFAULT_WEIGHT, DEFAULT_STYLE, family=FONT_FAMILY)
+    self.bold_font = get_font(size, "bold", DEFAULT_STYLE, family=FONT_FAMILY)
+    self.char_width = self.font.measure("0")
+    self.line_height = self.font.linespace
+    self.width = 0
+    self.height = 0
+
+  def layout(self, viewport_width: int):
+    self.width = viewport_width
+    self.height = self.line_count * self.line_height
+
+  def _newlines(self, block: int) -> array:
+    newlines = self.block_newlines.get(block)
+    if newlines is None:
+      text = self.text
+      newlines = array("L")
+      end = min((block + 1) * BLOCK_SIZE, len(text))
+      position = text.find("\n", block * BLOCK_SIZE, end)
+      while position >= 0:
+        newlines.append(position)
+        position = text.find("\n", position + 1, end)
+      self.block_newlines[block] = newlines
+    return newlines
+
+  def _line_range(self, line: int) -> Tuple[int, int]:
+    text = self.text
+    if line == 0:
+      start = 0
+    else:
+      # The line starts after the `line`-th newline.
+      block = bisect_left(self.block_lines, line) - 1
+      start = self._newlines(block)[line - self.block_lines[block] - 1] + 1
+    end = text.find("\n", start)
+    if end < 0:
+      end = len(text)
+    if end > start and text[end - 1] == "\r":
+      end -= 1
+    return start, end
+
+  def _markup_resume(self, position: int) -> int:
+    # Where to start matching markup so that a comment or tag that is still
+    # open at `position` is found whole.
+    text = self.text
+    comment = text.rfind("<!--", 0, position)
+    if comment >= 0 and text.find("-->", comment + 4, position) < 0:
+      return comment
+    tag = text.rfind("<", 0, position)
+    if tag >= 0 and text.find(">", tag, position) < 0:
+      return tag
+    return position
+
+  def _markup(self, start: int, end: int) -> List[Tuple[int, int]]:
+    spans = []
+    position = self._markup_resume(start)
+    while position < end:
+      match = MARKUP.search(self.text, position, len(self.text))
+      if match is None or match.start() >= end:
+        break
+      spans.append((match.start(), match.end()))
+      position = match.end()
+    return spans
+
+  def _segments(self, start: int, end: int,
+                spans: List[Tuple[int, int]]) -> Iterator[Segment]:
+    # Splits `text[start:end]` into (text, is_markup) runs.
+    index = bisect_right(spans, (start, start))
+    if index > 0 and spans[index - 1][1] > start:
+      index -= 1
+    position = start
+    while index < len(spans) and spans[index][0] < end:
+      markup_start = max(spans[index][0], start)
+      markup_end = min(spans[index][1], end)
+      if markup_end > position:
+        if markup_start > position:
+          yield self.text[position:markup_start], False
+        yield self.text[markup_start:markup_end], True
+        position = markup_end
+      index += 1
+    if position < end:
+      yield self.text[position:end], False
+
+  def paint(self, scroll: float, height: int) -> Commands:
+    commands: Commands = []
+    first = max(int((scroll - VSTEP) // self.line_height) - OVERSCAN, 0)
+    last = min(int((scroll + height - VSTEP) // self.line_height) + OVERSCAN + 1,
+               self.line_count)
+    # Long lines (minified pages) are cut at the right edge of the viewport.
+    max_columns = max(self.width - HSTEP, 0) // self.char_width + 1
+    lines = []
+    for line in range(first, last):
+      start, end = self._line_range(line)
+      lines.append((line, start, min(end, start + max_columns)))
+    if not lines:
+      return commands
+    spans = self._markup(lines[0][1], lines[-1][2])
+    for line, start, end in lines:
+      x = HSTEP
+      y = VSTEP + line * self.line_height
+      for segment, is_markup in self._segments(start, end, spans):
+        if not segment.isspace():
+          font = self.font if is_markup else self.bold_font
+          commands.append(DrawText(x1=x, y1=y, text=segment, font=font))
+        x += len(segment) * self.char_width
+    return commands